@@ -0,0 +1,168 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+
+class AvatarCache:
+    """Content addressed on-disk cache for profile pictures.
+
+    Images are stored once per content hash, an index maps the urls to them together with the ETag and
+    Last-Modified headers, so a changed picture is detected with a conditional request that costs no image
+    bytes when nothing changed. When the cache grows over max_size the least recently used images are removed.
+    """
+
+    def __init__(self, directory="avatar_cache", max_size=50 * 1024 * 1024, max_age=60 * 60):
+        self.directory = directory
+        self.max_size = max_size
+        # images fetched or revalidated less than max_age seconds ago are used without asking twitter at all
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._db_connection = sqlite3.connect(os.path.join(directory, "index.sqlite3"), check_same_thread=False)
+        self._db_connection.execute(
+            """create table if not exists avatars (
+                url text primary key,
+                hash text,
+                size integer,
+                etag,
+                last_modified,
+                validated real,
+                last_access real
+            );""")
+        self._db_connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._db_connection.close()
+
+    def _path(self, content_hash):
+        return os.path.join(self.directory, content_hash)
+
+    def _read(self, url, touch=True):
+        """Returns (content, etag, last_modified, validated) of a cached url or None"""
+        with self._lock:
+            row = self._db_connection.execute(
+                "select hash, etag, last_modified, validated from avatars where url = ?;", [url]).fetchone()
+            if row is None:
+                return None
+            try:
+                with open(self._path(row[0]), 'rb') as f:
+                    content = f.read()
+            except OSError:
+                # the file is gone, forget about it
+                self._db_connection.execute("delete from avatars where url = ?;", [url])
+                self._db_connection.commit()
+                return None
+            if touch:
+                self._db_connection.execute("update avatars set last_access = ? where url = ?;", [time.time(), url])
+                self._db_connection.commit()
+        return content, row[1], row[2], row[3]
+
+    def fresh(self, url):
+        """Returns the cached image if it was validated recently enough, otherwise None"""
+        cached = self._read(url)
+        if cached is not None and time.time() - cached[3] < self.max_age:
+            return cached[0]
+        return None
+
+    def cached(self, url):
+        """Returns the cached image no matter how old it is, None if there is none"""
+        cached = self._read(url)
+        return cached[0] if cached is not None else None
+
+    def conditional_headers(self, url):
+        """Headers to revalidate a cached image, empty if there is nothing cached"""
+        cached = self._read(url, touch=False)
+        headers = {}
+        if cached is not None:
+            if cached[1]:
+                headers['If-None-Match'] = cached[1]
+            if cached[2]:
+                headers['If-Modified-Since'] = cached[2]
+        return headers
+
+    def update(self, url, status_code, headers, content):
+        """Stores the response of a (conditional) request and returns the image bytes"""
+        now = time.time()
+        if status_code == 304:
+            cached = self._read(url)
+            if cached is not None:
+                with self._lock:
+                    self._db_connection.execute("update avatars set validated = ? where url = ?;", [now, url])
+                    self._db_connection.commit()
+                return cached[0]
+            raise ValueError(f"Got 304 for {url} but it is not cached")
+
+        content_hash = hashlib.sha256(content).hexdigest()
+        path = self._path(content_hash)
+        with self._lock:
+            if not os.path.exists(path):
+                tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(content)
+                os.replace(tmp_path, path)
+            previous = self._db_connection.execute("select hash from avatars where url = ?;", [url]).fetchone()
+            self._db_connection.execute(
+                "insert into avatars (url, hash, size, etag, last_modified, validated, last_access) "
+                "values (?, ?, ?, ?, ?, ?, ?) on conflict(url) do update set hash=excluded.hash, "
+                "size=excluded.size, etag=excluded.etag, last_modified=excluded.last_modified, "
+                "validated=excluded.validated, last_access=excluded.last_access;",
+                [url, content_hash, len(content), headers.get('ETag'), headers.get('Last-Modified'), now, now])
+            if previous is not None and previous[0] != content_hash:
+                self._remove_unreferenced(previous[0])
+            self._evict()
+            self._db_connection.commit()
+        return content
+
+    def _remove_unreferenced(self, content_hash):
+        if self._db_connection.execute("select 1 from avatars where hash = ? limit 1;", [content_hash]).fetchone():
+            return
+        try:
+            os.remove(self._path(content_hash))
+        except OSError:
+            pass
+
+    def _evict(self):
+        """Removes the least recently used images until the cache fits into max_size again"""
+        # sizes are counted per distinct file, several urls can point to the same image
+        total = self._db_connection.execute(
+            "select coalesce(sum(size), 0) from (select max(size) as size from avatars group by hash);").fetchone()[0]
+        if total <= self.max_size:
+            return
+        rows = self._db_connection.execute(
+            "select url, hash, size from avatars order by last_access;").fetchall()
+        for url, content_hash, size in rows:
+            if total <= self.max_size:
+                break
+            self._db_connection.execute("delete from avatars where url = ?;", [url])
+            if not self._db_connection.execute(
+                    "select 1 from avatars where hash = ? limit 1;", [content_hash]).fetchone():
+                total -= size
+                self._remove_unreferenced(content_hash)
+
+    def get(self, url):
+        """Returns the image bytes for url, from the cache whenever possible"""
+        import requests
+        content = self.fresh(url)
+        if content is not None:
+            return content
+        headers = self.conditional_headers(url)
+        try:
+            response = requests.get(url, headers=headers, timeout=30)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            # better an old picture than none at all
+            cached = self._read(url)
+            if cached is not None:
+                print(e)
+                return cached[0]
+            raise
+        try:
+            return self.update(url, response.status_code, response.headers, response.content)
+        except ValueError:
+            # the image got evicted in the meantime
+            response = requests.get(url, timeout=30)
+            response.raise_for_status()
+            return self.update(url, response.status_code, response.headers, response.content)
@@ -0,0 +1,302 @@
+"""Local stand-in for the parts of the Twitter API the blocker uses, so it can be measured without an account.
+
+Run it from the repository root, e.g. ``python benchmarks/fake_twitter_server.py --port 8765 --latency 0.05``,
+and point a Blocker to it with ``Blocker(base_url="http://127.0.0.1:8765/1.1")``. Any credentials are accepted.
+
+Targets are made up from their screen name: ``followers_10000`` (user id 10000) has 10000 followers. The follower
+ids are random but the same on every run. ``suspended_<anything>`` is suspended, every other name doesn't exist.
+users/lookup makes the followers up from their id too: every 50th is verified, every 20th has "journalist" in its
+bio, every 100th is followed by the account and every 1000th is suspended.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from collections import Counter
+import argparse
+import json
+import random
+import threading
+import time
+
+PAGE_SIZE = 5000
+# user ids below this are targets, their id is their follower count
+MAX_TARGET_ID = 1_000_000_000
+AUTHENTICATED_USER_ID = 1
+ENDPOINTS = ('account/verify_credentials', 'application/rate_limit_status', 'blocks/create', 'blocks/destroy',
+             'blocks/ids', 'followers/ids', 'users/lookup', 'users/show')
+USER_NOT_FOUND = (404, 50, "User not found.")
+USER_SUSPENDED = (403, 63, "User has been suspended.")
+RATE_LIMIT_EXCEEDED = (429, 88, "Rate limit exceeded")
+INTERNAL_ERROR = (500, 131, "Internal error")
+
+
+def follower_ids(target_id, page):
+    rng = random.Random(target_id * 1_000_003 + page)
+    count = min(PAGE_SIZE, target_id - page * PAGE_SIZE)
+    return [rng.randrange(MAX_TARGET_ID, 1_600_000_000_000_000_000) for _ in range(count)]
+
+
+def user_json(user_id, screen_name=None):
+    return {
+        'id': user_id,
+        'id_str': str(user_id),
+        'name': screen_name or f"user {user_id}",
+        'screen_name': screen_name or f"user_{user_id}",
+        'description': "journalist, made up by fake_twitter_server.py" if user_id % 20 == 0
+        else "Made up by fake_twitter_server.py",
+        'followers_count': user_id if user_id < MAX_TARGET_ID else user_id % 5000,
+        'verified': user_id % 50 == 0,
+        'following': user_id % 100 == 0,
+        'profile_image_url_https': "https://abs.twimg.com/sticky/default_profile_images/default_profile_normal.png",
+    }
+
+
+class EndpointLimit:
+    """One rate limit window of an endpoint, it works like twitter's: limit requests, then wait for the reset"""
+
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self.remaining = limit
+        self.reset = time.time() + window
+
+    def hit(self):
+        """Returns False if the request is over the limit"""
+        now = time.time()
+        if now >= self.reset:
+            self.remaining = self.limit
+            self.reset = now + self.window
+        if self.remaining == 0:
+            return False
+        self.remaining -= 1
+        return True
+
+
+class FakeTwitterServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0, jitter=0.0, error_rates=None, rate_limits=None,
+                 seed=None):
+        super(FakeTwitterServer, self).__init__(address, FakeTwitterHandler)
+        # seconds every request takes, plus up to jitter seconds at random
+        self.latency = latency
+        self.jitter = jitter
+        # endpoint -> share of requests that fail with an internal error
+        self.error_rates = error_rates or {}
+        # endpoint -> (limit, window), endpoints without one are not limited
+        self.limits = {endpoint: EndpointLimit(*limit) for endpoint, limit in (rate_limits or {}).items()}
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.blocked_ids = set()
+        self.stats = Counter()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/1.1"
+
+    def rate_limit_status(self):
+        resources = {}
+        now = time.time()
+        for endpoint in ENDPOINTS:
+            family = endpoint.split('/')[0]
+            limit = self.limits.get(endpoint)
+            resources.setdefault(family, {})[f"/{endpoint}"] = {
+                'limit': limit.limit if limit else 1_000_000,
+                'remaining': limit.remaining if limit else 1_000_000,
+                'reset': int(limit.reset if limit else now + 900)}
+        return {'resources': resources}
+
+
+class FakeTwitterHandler(BaseHTTPRequestHandler):
+    # keep-alive, the clients reuse their connections like they would with twitter
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, with Nagle every response would wait for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        self.handle_endpoint(url.path, parse_qs(url.query))
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        params = parse_qs(self.rfile.read(length).decode()) if length else {}
+        params.update(parse_qs(url.query))
+        self.handle_endpoint(url.path, params)
+
+    def handle_endpoint(self, path, params):
+        server: FakeTwitterServer = self.server
+        endpoint = path[len('/1.1/'):-len('.json')] if path.startswith('/1.1/') and path.endswith('.json') else path
+        params = {key: values[-1] for key, values in params.items()}
+
+        delay = server.latency + (server.random.random() * server.jitter if server.jitter else 0)
+        if delay:
+            time.sleep(delay)
+
+        limit = server.limits.get(endpoint)
+        with server.lock:
+            server.stats[endpoint] += 1
+            allowed = limit.hit() if limit else True
+            failed = server.random.random() < server.error_rates.get(endpoint, 0)
+        headers = {
+            'x-rate-limit-limit': limit.limit if limit else 1_000_000,
+            'x-rate-limit-remaining': limit.remaining if limit else 1_000_000,
+            'x-rate-limit-reset': int(limit.reset if limit else time.time() + 900),
+        }
+        if not allowed:
+            server.stats['rate_limited'] += 1
+            return self.send_error_json(RATE_LIMIT_EXCEEDED, headers)
+        if failed:
+            server.stats['errors'] += 1
+            return self.send_error_json(INTERNAL_ERROR, headers)
+
+        handler = getattr(self, 'endpoint_' + endpoint.replace('/', '_'), None)
+        if handler is None:
+            return self.send_json(404, {'errors': [{'code': 34, 'message': "Sorry, that page does not exist."}]})
+        result = handler(params)
+        if isinstance(result, tuple):
+            return self.send_error_json(result, headers)
+        self.send_json(200, result, headers)
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json;charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, str(value))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, error, headers=None):
+        status, code, message = error
+        self.send_json(status, {'errors': [{'code': code, 'message': message}]}, headers)
+
+    def find_user(self, params):
+        """Returns (user_id, screen_name) of a target or the error tuple"""
+        if 'user_id' in params:
+            user_id = int(params['user_id'])
+            return user_id, f"followers_{user_id}" if user_id < MAX_TARGET_ID else None
+        screen_name = params.get('screen_name', '')
+        if screen_name.startswith('suspended_'):
+            return USER_SUSPENDED
+        if screen_name.startswith('followers_') and screen_name[10:].isdigit() \
+                and 0 < int(screen_name[10:]) < MAX_TARGET_ID:
+            return int(screen_name[10:]), screen_name
+        return USER_NOT_FOUND
+
+    def endpoint_account_verify_credentials(self, params):
+        return user_json(AUTHENTICATED_USER_ID, "benchmark")
+
+    def endpoint_application_rate_limit_status(self, params):
+        return self.server.rate_limit_status()
+
+    def endpoint_users_show(self, params):
+        user = self.find_user(params)
+        if len(user) == 3:
+            return user
+        return user_json(*user)
+
+    def endpoint_users_lookup(self, params):
+        user_ids = [int(user_id) for user_id in params.get('user_id', '').split(',') if user_id]
+        if len(user_ids) > 100:
+            return 403, 18, "Too many terms specified in query."
+        users = [user_json(user_id) for user_id in user_ids if user_id % 1000 != 0]
+        if not users:
+            return 404, 17, "No user matches for specified terms."
+        return users
+
+    def endpoint_followers_ids(self, params):
+        user = self.find_user(params)
+        if len(user) == 3:
+            return user
+        target_id = user[0] if user[0] < MAX_TARGET_ID else 0
+        # the first page is cursor -1, page n > 0 is cursor n
+        page = max(int(params.get('cursor', -1)), 0)
+        has_next = (page + 1) * PAGE_SIZE < target_id
+        return {
+            'ids': follower_ids(target_id, page) if page * PAGE_SIZE < target_id else [],
+            'next_cursor': page + 1 if has_next else 0,
+            'next_cursor_str': str(page + 1 if has_next else 0),
+            'previous_cursor': -page,
+            'previous_cursor_str': str(-page),
+        }
+
+    def endpoint_blocks_create(self, params):
+        user_id = int(params['user_id'])
+        with self.server.lock:
+            self.server.blocked_ids.add(user_id)
+        return user_json(user_id)
+
+    def endpoint_blocks_destroy(self, params):
+        user_id = int(params['user_id'])
+        with self.server.lock:
+            self.server.blocked_ids.discard(user_id)
+        return user_json(user_id)
+
+    def endpoint_blocks_ids(self, params):
+        with self.server.lock:
+            blocked_ids = sorted(self.server.blocked_ids, reverse=True)
+        page = max(int(params.get('cursor', -1)), 0)
+        has_next = (page + 1) * PAGE_SIZE < len(blocked_ids)
+        return {
+            'ids': blocked_ids[page * PAGE_SIZE:(page + 1) * PAGE_SIZE],
+            'next_cursor': page + 1 if has_next else 0,
+            'next_cursor_str': str(page + 1 if has_next else 0),
+            'previous_cursor': -page,
+            'previous_cursor_str': str(-page),
+        }
+
+
+def parse_endpoint_values(values, parse):
+    """Turns ['blocks/create=0.01', ...] into {'blocks/create': parse('0.01'), ...}"""
+    result = {}
+    for value in values or ():
+        endpoint, _, setting = value.partition('=')
+        if endpoint not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"unknown endpoint {endpoint}, one of {', '.join(ENDPOINTS)}")
+        result[endpoint] = parse(setting)
+    return result
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765, help="0 picks a free port (default: %(default)s)")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds every request takes")
+    parser.add_argument('--jitter', type=float, default=0.0, help="up to that many seconds more at random")
+    parser.add_argument('--error-rate', action='append', metavar='ENDPOINT=RATE',
+                        help="share of requests to an endpoint that fail, e.g. blocks/create=0.01")
+    parser.add_argument('--rate-limit', action='append', metavar='ENDPOINT=LIMIT:WINDOW',
+                        help="requests per window seconds, e.g. followers/ids=15:900")
+    parser.add_argument('--seed', type=int, default=None, help="seed for latency jitter and errors")
+    return parser
+
+
+def create_server(args):
+    return FakeTwitterServer(
+        (args.host, args.port), latency=args.latency, jitter=args.jitter,
+        error_rates=parse_endpoint_values(args.error_rate, float),
+        rate_limits=parse_endpoint_values(args.rate_limit, lambda v: tuple(int(x) for x in v.split(':'))),
+        seed=args.seed)
+
+
+def main():
+    args = build_parser().parse_args()
+    server = create_server(args)
+    # the first line is read by throughput_benchmark.py when it starts the server itself
+    print(server.url, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(dict(server.stats)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""Compares the memory used for follower ids by plain int lists and by the array('q') buffers Blocker uses.
+
+Run it from the repository root, e.g. ``python benchmarks/memory_benchmark.py --count 10000000``.
+Nothing is sent to Twitter, the end to end part uses an API stand-in that blocks instantly.
+"""
+from array import array
+import argparse
+import os
+import random
+import sys
+import tempfile
+import tracemalloc
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PAGE_SIZE = 5000
+
+
+def pages(count, seed=1):
+    """Pages of random follower ids like GetFollowerIDsPaged returns them"""
+    rng = random.Random(seed)
+    for start in range(0, count, PAGE_SIZE):
+        yield [rng.randrange(1, 1_600_000_000_000_000_000) for _ in range(min(PAGE_SIZE, count - start))]
+
+
+def list_pipeline(count):
+    """How the ids used to be kept: a list of ints, a list of 3-lists for saving and an insert(0)"""
+    ids = []
+    for page in pages(count):
+        ids.extend(page)
+    batch = [[user_id, 1, "reason"] for user_id in ids]
+    ids.insert(0, 1)
+    return ids, batch
+
+
+def array_pipeline(count):
+    """How the ids are kept now: one array('q'), rows are only generated while they are saved"""
+    ids = array('q')
+    for page in pages(count):
+        ids.extend(page)
+    batch = ((user_id, 1, "reason") for user_id in ids)
+    return ids, batch
+
+
+def measure(function, *args):
+    tracemalloc.start()
+    result = function(*args)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current, peak
+
+
+class InstantApi:
+    """Stands in for twitter.Api, every block succeeds right away"""
+
+    def __init__(self):
+        self.rate_limit = types.SimpleNamespace(resources={})
+
+    def CreateBlock(self, user_id, include_entities=False, skip_status=True):
+        return types.SimpleNamespace(id=user_id, screen_name=str(user_id))
+
+
+def block_users_peak(count):
+    """Peak Python memory of Blocker.block_users for count followers, sqlite's own memory isn't included"""
+    from twitter_blocker import Blocker
+
+    ids = array('q')
+    for page in pages(count):
+        ids.extend(page)
+    with tempfile.TemporaryDirectory() as directory:
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            with Blocker(flush_rows=5000) as blocker:
+                blocker.api = InstantApi()
+                tracemalloc.start()
+                for _ in blocker.block_users(1, ids, "benchmark"):
+                    pass
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+        finally:
+            os.chdir(cwd)
+    return peak
+
+
+def mib(n):
+    return f"{n / 1024 / 1024:8.1f} MiB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=1_000_000, help="number of follower ids")
+    parser.add_argument('--end-to-end', type=int, default=100_000,
+                        help="number of followers for the Blocker.block_users run, 0 to skip it")
+    args = parser.parse_args()
+
+    print(f"{args.count} follower ids")
+    for name, function in (("list", list_pipeline), ("array('q')", array_pipeline)):
+        current, peak = measure(function, args.count)
+        print(f"{name:>12}: held {mib(current)}, peak {mib(peak)}, {current / args.count:6.1f} bytes per id")
+
+    if args.end_to_end:
+        print(f"Blocker.block_users with {args.end_to_end} followers: peak {mib(block_users_peak(args.end_to_end))}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+"""Measures blocks per second, follower fetch throughput, peak memory and SQLite time against a fake Twitter API.
+
+Run it from the repository root, e.g. ``python benchmarks/throughput_benchmark.py --sizes 10000,1000000``.
+It starts benchmarks/fake_twitter_server.py unless --server is given, every scenario and size then runs in its
+own process with a fresh database, so the peak RSS of one doesn't hide the next. Server options like latency
+or rate limits are passed through after ``--``, e.g. ``-- --latency 0.05 --error-rate blocks/create=0.01``.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS))
+
+SCENARIOS = ('fetch', 'block_followers', 'continue_blocking', 'blocker_worker')
+REASON = "benchmark"
+
+
+class TimedCursor:
+    """Wraps a sqlite3 cursor or connection and adds up the time spent in it"""
+
+    def __init__(self, wrapped, timer):
+        self._wrapped = wrapped
+        self._timer = timer
+
+    def _timed(self, method, *args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self._timer.add(time.perf_counter() - start)
+
+    def execute(self, *args):
+        result = self._timed(self._wrapped.execute, *args)
+        return TimedCursor(result, self._timer)
+
+    def executemany(self, *args):
+        result = self._timed(self._wrapped.executemany, *args)
+        return TimedCursor(result, self._timer)
+
+    def fetchone(self):
+        return self._timed(self._wrapped.fetchone)
+
+    def fetchall(self):
+        return self._timed(self._wrapped.fetchall)
+
+    def commit(self):
+        return self._timed(self._wrapped.commit)
+
+    def rollback(self):
+        return self._timed(self._wrapped.rollback)
+
+    def cursor(self):
+        return TimedCursor(self._wrapped.cursor(), self._timer)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self._timed(self._wrapped.__next__)
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+
+class Timer:
+    def __init__(self):
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self.total += seconds
+
+
+def open_blocker(server_url):
+    from twitter_blocker import Blocker
+
+    blocker = Blocker(flush_rows=5000, base_url=server_url)
+    blocker.__enter__()
+    blocker.save_account_settings("benchmark", "benchmark", "benchmark", "benchmark")
+    blocker.authenticate()
+    if blocker.authenticated_user is None:
+        raise SystemExit(f"Could not authenticate against {server_url}")
+    return blocker
+
+
+def time_sqlite(blocker):
+    timer = Timer()
+    blocker._db_connection = TimedCursor(blocker._db_connection, timer)
+    blocker._cursor = TimedCursor(blocker._cursor, timer)
+    return timer
+
+
+def run_scenario(scenario, size, server_url):
+    """Runs one scenario in this process and returns its numbers"""
+    blocker = open_blocker(server_url)
+    try:
+        target = blocker.get_user(screen_name=f"followers_{size}")
+        if scenario == 'continue_blocking':
+            # a run that got interrupted before the first block, the fetch isn't part of the measurement
+            ids = blocker.get_follower_ids(target.twitter_id)
+            from array import array
+            user_ids = array('q')
+            for page in ids:
+                user_ids.extend(page)
+            blocker._save_to_current_block_run(target.twitter_id, user_ids, REASON)
+            del user_ids
+
+        timer = time_sqlite(blocker)
+        start = time.perf_counter()
+        count = 0
+        if scenario == 'fetch':
+            for page in blocker.get_follower_ids(target.twitter_id):
+                count += len(page)
+        elif scenario == 'block_followers':
+            for count in blocker.block_followers(target.twitter_id, REASON):
+                pass
+        elif scenario == 'continue_blocking':
+            for count in blocker.continue_blocking():
+                pass
+        elif scenario == 'blocker_worker':
+            from PySide6.QtCore import QCoreApplication
+            from twitter_blocker_gui import BlockerWorker
+
+            app = QCoreApplication.instance() or QCoreApplication([])
+            worker = BlockerWorker(blocker, target.twitter_id, REASON)
+            progress = []
+            worker.progress.connect(progress.append)
+            worker.run()
+            count = progress[-1]['count'] if progress else 0
+        blocker.flush()
+        elapsed = time.perf_counter() - start
+    finally:
+        blocker.__exit__(None, None, None)
+
+    return {
+        'scenario': scenario,
+        'size': size,
+        'count': count,
+        'seconds': round(elapsed, 3),
+        'per_second': round(count / elapsed, 1) if elapsed else None,
+        'sqlite_seconds': round(timer.total, 3),
+        # kilobytes on linux, bytes on macOS
+        'peak_rss_mib': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                              / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1),
+    }
+
+
+def run_isolated(scenario, size, server_url):
+    """Runs a scenario in a child process with a fresh database in a temporary directory"""
+    with tempfile.TemporaryDirectory() as directory:
+        process = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--run', scenario, str(size), '--server', server_url],
+            cwd=directory, stdout=subprocess.PIPE, text=True)
+    if process.returncode != 0:
+        # one broken scenario shouldn't cost the numbers of all the others
+        return {'scenario': scenario, 'size': size, 'error': f"exit code {process.returncode}"}
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def start_server(server_args):
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(BENCHMARKS, 'fake_twitter_server.py'), '--port', '0', *server_args],
+        stdout=subprocess.PIPE, text=True)
+    return server, server.stdout.readline().strip()
+
+
+def print_result(result):
+    if 'error' in result:
+        print(f"{result['scenario']:>18} {result['size']:>9} failed with {result['error']}", flush=True)
+        return
+    print(f"{result['scenario']:>18} {result['size']:>9} {result['count']:>9} {result['seconds']:>9.2f}s "
+          f"{result['per_second'] or 0:>10.1f}/s {result['sqlite_seconds']:>8.2f}s "
+          f"{result['sqlite_seconds'] / result['seconds'] * 100 if result['seconds'] else 0:>5.1f}% "
+          f"{result['peak_rss_mib']:>8.1f} MiB", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default="10000,100000",
+                        help="follower counts of the targets, comma separated (default: %(default)s)")
+    parser.add_argument('--scenarios', default=",".join(SCENARIOS),
+                        help="comma separated, any of %(default)s")
+    parser.add_argument('--server', help="url of a running fake_twitter_server.py, e.g. http://127.0.0.1:8765/1.1")
+    parser.add_argument('--json', action='store_true', help="print the results as JSON lines instead of a table")
+    parser.add_argument('--run', nargs=2, metavar=('SCENARIO', 'SIZE'), help=argparse.SUPPRESS)
+    parser.add_argument('server_args', nargs='*', help="options for fake_twitter_server.py after --")
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_scenario(args.run[0], int(args.run[1]), args.server)), flush=True)
+        # the child is thrown away anyway. Skipping the interpreter shutdown keeps PySide6 builds that crash in
+        # it after many signals, e.g. 6.12 on python 3.11, from failing a scenario that was measured fine
+        os._exit(0)
+
+    server = None
+    server_url = args.server
+    if server_url is None:
+        server, server_url = start_server(args.server_args)
+    try:
+        if not args.json:
+            print(f"{'scenario':>18} {'followers':>9} {'count':>9} {'time':>10} {'throughput':>12} "
+                  f"{'sqlite':>9} {'share':>6} {'peak rss':>12}")
+        for size in (int(s) for s in args.sizes.split(',')):
+            for scenario in args.scenarios.split(','):
+                result = run_isolated(scenario, size, server_url)
+                if args.json:
+                    print(json.dumps(result), flush=True)
+                else:
+                    print_result(result)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
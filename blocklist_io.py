@@ -0,0 +1,59 @@
+"""File formats to share blocklists, everything is read and written as a stream.
+
+CSV has a header and one row per block: user_id, user_name, parent_id, reason and block_date, only user_id is
+required on import. The binary format is MAGIC, the length of a JSON object with the metadata as 4 byte big
+endian number, the JSON object and the sorted user ids encoded like id_codec does it, each user only once.
+"""
+import csv
+import json
+import struct
+
+from id_codec import iter_decode, iter_encode_sorted
+
+MAGIC = b"TWBL\x01"
+CSV_COLUMNS = ('user_id', 'user_name', 'parent_id', 'reason', 'block_date')
+READ_SIZE = 64 * 1024
+
+
+def is_binary(f):
+    """Tells a binary blocklist from a CSV one without consuming anything, f has to be a buffered binary file"""
+    return f.peek(len(MAGIC))[:len(MAGIC)] == MAGIC
+
+
+def write_binary(f, sorted_ids, metadata):
+    header = json.dumps(metadata).encode('utf-8')
+    f.write(MAGIC)
+    f.write(struct.pack('>I', len(header)))
+    f.write(header)
+    for chunk in iter_encode_sorted(sorted_ids):
+        f.write(chunk)
+
+
+def read_binary(f):
+    """Returns (metadata, iterator over the user ids)"""
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a binary blocklist")
+    length, = struct.unpack('>I', f.read(4))
+    metadata = json.loads(f.read(length).decode('utf-8'))
+    return metadata, iter_decode(iter(lambda: f.read(READ_SIZE), b""))
+
+
+def write_csv(f, rows):
+    """Writes (user_id, user_name, parent_id, reason, block_date) rows to a text file"""
+    writer = csv.writer(f)
+    writer.writerow(CSV_COLUMNS)
+    writer.writerows(rows)
+
+
+def read_csv(f):
+    """Yields (user_id, parent_id, reason) of every row, parent_id and reason are None if they are missing"""
+    reader = csv.DictReader(f)
+    if reader.fieldnames is None or 'user_id' not in reader.fieldnames:
+        raise ValueError("The CSV file needs a user_id column")
+    for line, row in enumerate(reader, start=2):
+        try:
+            user_id = int(row['user_id'])
+            parent_id = int(row['parent_id']) if row.get('parent_id') else None
+        except ValueError:
+            raise ValueError(f"Line {line}: user_id and parent_id must be numbers") from None
+        yield user_id, parent_id, row.get('reason') or None
@@ -0,0 +1,50 @@
+class FilterRules:
+    """Rules for followers that are not blocked, checked against the user_metadata table before blocking.
+
+    allow is a list of user ids and screen names that are never blocked. Users with more than max_followers
+    or less than min_followers followers are skipped, verified ones with skip_verified, the ones the account
+    follows with skip_following and everyone with one of skip_keywords in their bio. Users that users/lookup
+    doesn't return are deleted or suspended, there is nothing to block there.
+    """
+
+    def __init__(self, allow=(), skip_verified=False, skip_following=False, min_followers=None, max_followers=None,
+                 skip_keywords=()):
+        self.allow_ids = [int(a) for a in allow if isinstance(a, int) or str(a).isdigit()]
+        # screen names are case insensitive on twitter
+        self.allow_screen_names = [str(a).lstrip('@').lower() for a in allow
+                                   if not (isinstance(a, int) or str(a).isdigit())]
+        self.skip_verified = skip_verified
+        self.skip_following = skip_following
+        self.min_followers = min_followers
+        self.max_followers = max_followers
+        self.skip_keywords = [k.lower() for k in skip_keywords if k]
+
+    def __bool__(self):
+        return bool(self.allow_ids or self.allow_screen_names or self.skip_verified or self.skip_following
+                    or self.min_followers is not None or self.max_followers is not None or self.skip_keywords)
+
+    def where(self, alias='m'):
+        """SQL condition and parameters that are true for the users that may be blocked"""
+        conditions = [f"{alias}.found = 1"]
+        parameters = []
+        if self.allow_ids:
+            conditions.append(f"{alias}.user_id not in ({', '.join('?' * len(self.allow_ids))})")
+            parameters.extend(self.allow_ids)
+        if self.allow_screen_names:
+            conditions.append(
+                f"lower({alias}.screen_name) not in ({', '.join('?' * len(self.allow_screen_names))})")
+            parameters.extend(self.allow_screen_names)
+        if self.skip_verified:
+            conditions.append(f"not {alias}.verified")
+        if self.skip_following:
+            conditions.append(f"not {alias}.following")
+        if self.min_followers is not None:
+            conditions.append(f"{alias}.followers_count >= ?")
+            parameters.append(self.min_followers)
+        if self.max_followers is not None:
+            conditions.append(f"{alias}.followers_count <= ?")
+            parameters.append(self.max_followers)
+        for keyword in self.skip_keywords:
+            conditions.append(f"instr(lower(coalesce({alias}.description, '')), ?) = 0")
+            parameters.append(keyword)
+        return " and ".join(conditions), parameters
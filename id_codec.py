@@ -0,0 +1,125 @@
+"""Compact blobs of user ids: sorted, delta encoded varints, zlib compressed.
+
+Follower ids are spread over a big range but close to each other once sorted, so most deltas fit into one to
+three bytes instead of eight. Everything is done on numpy arrays a chunk at a time, one pass per varint byte
+instead of a python loop per id, so millions of ids take a fraction of a second and never need more memory
+than a chunk of temporaries next to the ids themselves.
+"""
+from itertools import islice
+import zlib
+
+import numpy as np
+
+# ids encoded and decompressed bytes decoded at once
+CHUNK_SIZE = 1 << 16
+
+
+def _pack_varints(deltas) -> bytes:
+    deltas = deltas.astype(np.uint64)
+    lengths = np.ones(len(deltas), dtype=np.int64)
+    for k in range(1, 10):
+        lengths += deltas >= np.uint64(1 << (7 * k))
+    starts = np.cumsum(lengths) - lengths
+    out = np.empty(int(lengths.sum()), dtype=np.uint8)
+    for k in range(int(lengths.max(initial=0))):
+        has_byte = lengths > k
+        value = (deltas[has_byte] >> np.uint64(7 * k)) & np.uint64(0x7f)
+        more = (lengths[has_byte] > k + 1).astype(np.uint64) << np.uint64(7)
+        out[starts[has_byte] + k] = value | more
+    return out.tobytes()
+
+
+def _unpack_varints(data):
+    """Values of the varints in data, which has to end with the last byte of one"""
+    # every varint ends with a byte that has the high bit cleared
+    ends = (data & 0x80) == 0
+    starts = np.flatnonzero(np.concatenate(([True], ends[:-1])))
+    positions = np.arange(len(data)) - np.repeat(starts, np.diff(np.append(starts, len(data))))
+    values = (data & 0x7f).astype(np.uint64) << (7 * positions).astype(np.uint64)
+    return np.add.reduceat(values, starts)
+
+
+def _id_chunks(ids, chunk_size):
+    if isinstance(ids, np.ndarray):
+        for i in range(0, len(ids), chunk_size):
+            yield ids[i:i + chunk_size]
+        return
+    ids = iter(ids)
+    while True:
+        chunk = np.fromiter(islice(ids, chunk_size), dtype=np.int64)
+        if not len(chunk):
+            return
+        yield chunk
+
+
+def iter_encode_sorted(sorted_ids, chunk_size=CHUNK_SIZE):
+    """Streaming encode_ids for ids that come sorted already, e.g. from an order by, yields the blob in pieces"""
+    compressor = zlib.compressobj()
+    previous = 0
+    for chunk in _id_chunks(sorted_ids, chunk_size):
+        deltas = np.diff(chunk, prepend=previous)
+        if deltas.min() < 0:
+            raise ValueError("ids are not sorted")
+        previous = int(chunk[-1])
+        yield compressor.compress(_pack_varints(deltas))
+    yield compressor.flush()
+
+
+def encode_ids(ids) -> bytes:
+    """Packs user ids into a blob, duplicates are dropped"""
+    ids = np.sort(np.asarray(ids, dtype=np.int64))
+    duplicates = ids[1:] == ids[:-1]
+    if duplicates.any():
+        ids = ids[np.concatenate(([True], ~duplicates))]
+    return b"".join(iter_encode_sorted(ids))
+
+
+def _decompressed(chunks, piece_size=CHUNK_SIZE):
+    # with a max_length a small blob can't turn into one huge piece
+    decompressor = zlib.decompressobj()
+    for chunk in chunks:
+        data = decompressor.decompress(chunk, piece_size)
+        while data:
+            yield data
+            data = decompressor.decompress(decompressor.unconsumed_tail, piece_size)
+    yield decompressor.flush()
+
+
+def iter_decode_arrays(chunks):
+    """Yields the ids of a blob that arrives in pieces as sorted int64 arrays"""
+    rest = np.empty(0, dtype=np.uint8)
+    previous = np.uint64(0)
+    for data in _decompressed(chunks):
+        data = np.concatenate((rest, np.frombuffer(data, dtype=np.uint8)))
+        ends = np.flatnonzero((data & 0x80) == 0)
+        if not len(ends):
+            rest = data
+            continue
+        # a varint can be split between two pieces, its start waits for the next one
+        complete = ends[-1] + 1
+        rest = data[complete:]
+        values = _unpack_varints(data[:complete])
+        values[0] += previous
+        ids = np.cumsum(values)
+        previous = ids[-1]
+        yield ids.astype(np.int64)
+
+
+def iter_decode(chunks):
+    """Yields the ids of a blob from encode_ids or iter_encode_sorted that arrives in pieces"""
+    for ids in iter_decode_arrays(chunks):
+        yield from ids.tolist()
+
+
+def decode_ids(blob) -> np.ndarray:
+    """Unpacks a blob from encode_ids into a sorted int64 array"""
+    return np.concatenate([np.empty(0, dtype=np.int64), *iter_decode_arrays([blob])])
+
+
+def isin_sorted(ids, sorted_ids):
+    """Mask of the ids that are in sorted_ids, a binary search per id instead of sorting both like np.isin"""
+    if not len(sorted_ids):
+        return np.zeros(len(ids), dtype=bool)
+    positions = np.searchsorted(sorted_ids, ids)
+    positions[positions == len(sorted_ids)] = 0
+    return sorted_ids[positions] == ids
@@ -0,0 +1,346 @@
+from collections import deque
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+
+# upper bounds of the latency histograms in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+OUTCOMES = ('succeeded', 'skipped', 'failed')
+
+
+def _format_labels(labels):
+    return ",".join(f'{key}="{value}"' for key, value in labels)
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m {seconds % 60}s"
+    return f"{seconds}s"
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                break
+        else:
+            i = len(BUCKETS)
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """(upper bound, count of values up to it) pairs like prometheus wants them, the last bound is +Inf"""
+        total = 0
+        result = []
+        for bound, count in zip(BUCKETS + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+
+class Metrics:
+    """Counters and latency histograms of everything a Blocker does, written to the sinks every interval seconds.
+
+    Besides the counters that only ever grow, there is the current run: how many users it is going to process,
+    how many of them are done and the ETA, based on the pace of the blocks that needed a request so far.
+    Runs can be nested, e.g. continue_blocking inside block_queue, only the outermost one counts.
+    """
+
+    def __init__(self, sinks=(), interval=10.0):
+        self.sinks = list(sinks)
+        self.interval = interval
+        self._lock = threading.RLock()
+        self._counters = {}
+        self._histograms = {}
+        self._last_export = time.monotonic()
+        self._run_depth = 0
+        self._run_started = None
+        self._run_expected = 0
+        self._run_baseline = {}
+        # optional function that gets the number of users left and returns the seconds they take at least,
+        # e.g. because of a rate limit that the pace so far doesn't show
+        self.eta_estimator = None
+
+    def add_sink(self, sink):
+        with self._lock:
+            self.sinks.append(sink)
+
+    def increment(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        self._maybe_export()
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+        self._maybe_export()
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - start, **labels)
+
+    def count_blocks(self, outcome, count=1):
+        if count:
+            self.increment('blocks', count, outcome=outcome)
+
+    def expect(self, count):
+        """Adds count users to what the current run is going to process"""
+        with self._lock:
+            self._run_expected += count
+
+    def begin_run(self):
+        with self._lock:
+            self._run_depth += 1
+            if self._run_depth == 1:
+                self._run_started = time.monotonic()
+                self._run_expected = 0
+                self._run_baseline = self._blocks()
+
+    def end_run(self):
+        with self._lock:
+            self._run_depth = max(self._run_depth - 1, 0)
+            finished = self._run_depth == 0
+        if finished:
+            self.export()
+
+    def _blocks(self):
+        return {outcome: self._counters.get(('blocks', (('outcome', outcome),)), 0) for outcome in OUTCOMES}
+
+    def run_status(self):
+        """Progress of the current or last run as dict, eta is None as long as it can't be told"""
+        with self._lock:
+            if self._run_started is None:
+                return None
+            blocks = {outcome: count - self._run_baseline.get(outcome, 0) for outcome, count in self._blocks().items()}
+            elapsed = time.monotonic() - self._run_started
+            done = sum(blocks.values())
+            expected = max(self._run_expected, done)
+            # skipped users cost no request, the pace comes from the ones that did
+            requested = blocks['succeeded'] + blocks['failed']
+            per_second = requested / elapsed if elapsed > 0 else 0
+            eta = (expected - done) / per_second if per_second > 0 else None
+            if self.eta_estimator is not None and expected > done and self._run_depth > 0:
+                eta = max(eta or 0, self.eta_estimator(expected - done))
+            return {
+                'running': self._run_depth > 0,
+                'expected': expected,
+                'done': done,
+                **blocks,
+                'elapsed': round(elapsed, 3),
+                'per_second': round(per_second, 2),
+                'eta': round(eta, 1) if eta is not None else None,
+            }
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'time': round(time.time(), 3),
+                'run': self.run_status(),
+                'counters': {
+                    f"{name}{{{_format_labels(labels)}}}" if labels else name: value
+                    for (name, labels), value in self._counters.items()},
+                'histograms': {
+                    f"{name}{{{_format_labels(labels)}}}" if labels else name: {
+                        'count': histogram.count,
+                        'sum': round(histogram.sum, 6),
+                        'buckets': {str(bound): count for bound, count in histogram.cumulative()}}
+                    for (name, labels), histogram in self._histograms.items()},
+            }
+
+    def histograms(self):
+        with self._lock:
+            return dict(self._histograms)
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def summary(self):
+        """One line for a status bar"""
+        status = self.run_status()
+        parts = []
+        if status is not None:
+            parts.append(f"{status['done']}/{status['expected']} done, {status['succeeded']} blocked, "
+                         f"{status['skipped']} skipped, {status['failed']} failed")
+            parts.append(f"{status['per_second']:.1f}/s")
+            if status['running'] and status['eta'] is not None:
+                parts.append(f"ETA {format_duration(status['eta'])}")
+        with self._lock:
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                if name == 'api_request_seconds' and histogram.count:
+                    parts.append(f"{dict(labels)['endpoint']} {histogram.mean() * 1000:.0f} ms")
+            commit = self._histograms.get(('db_commit_seconds', ()))
+            if commit is not None and commit.count:
+                parts.append(f"DB commit {commit.mean() * 1000:.1f} ms")
+            sleep = sum(value for (name, _), value in self._counters.items() if name == 'rate_limit_sleep_seconds')
+        if sleep:
+            parts.append(f"rate limit wait {format_duration(sleep)}")
+        return " · ".join(parts)
+
+    def _maybe_export(self):
+        if self.sinks and time.monotonic() - self._last_export >= self.interval:
+            self.export()
+
+    def export(self):
+        with self._lock:
+            self._last_export = time.monotonic()
+            if not self.sinks:
+                return
+            for sink in self.sinks:
+                try:
+                    sink.write(self)
+                except OSError as e:
+                    # metrics are not worth stopping a block run for
+                    print(e)
+
+    def close(self):
+        self.export()
+        with self._lock:
+            for sink in self.sinks:
+                sink.close()
+            # several blockers can share the metrics, the first one to exit closes them
+            self.sinks = []
+
+
+class ProgressAggregator:
+    """Turns the count a blocking generator yields for every user into at most one report every interval seconds.
+
+    update only costs a clock read when no report is due, so a worker can call it for every user and a GUI
+    gets the same number of events no matter how fast the users go by, e.g. when most of them are skipped.
+    A report has the count, the rate over the last rate_window seconds and, while a run is going on, the
+    outcomes and the ETA of the run from the metrics.
+    """
+
+    def __init__(self, metrics=None, interval=1 / 15, rate_window=5.0):
+        self.metrics = metrics
+        self.interval = interval
+        self.rate_window = rate_window
+        self.count = 0
+        self._samples = deque()
+        self._last_report = None
+
+    def update(self, count):
+        """Returns a report if one is due, otherwise None"""
+        self.count = count
+        now = time.monotonic()
+        if self._last_report is not None and now - self._last_report < self.interval:
+            return None
+        return self.report(now)
+
+    def report(self, now=None):
+        """The report for the last count, no matter if one is due"""
+        now = time.monotonic() if now is None else now
+        self._last_report = now
+        self._samples.append((now, self.count))
+        while len(self._samples) > 2 and now - self._samples[1][0] >= self.rate_window:
+            self._samples.popleft()
+        start, start_count = self._samples[0]
+        rate = (self.count - start_count) / (now - start) if now > start else 0.0
+        status = self.metrics.run_status() if self.metrics is not None else None
+        running = status is not None and status['running']
+        return {
+            'count': self.count,
+            'rate': round(rate, 1),
+            **{key: status[key] if running else None for key in ('expected', 'done', *OUTCOMES, 'eta')},
+        }
+
+
+def format_progress(report, label="Blocked users"):
+    """One line for a status label"""
+    parts = [f"{label}: {report['count']}"]
+    if report['rate']:
+        parts.append(f"{report['rate']:.1f}/s")
+    if report['expected']:
+        parts.append(f"{report['done']}/{report['expected']} done, {report['skipped']} skipped, "
+                     f"{report['failed']} failed")
+    if report['eta'] is not None:
+        parts.append(f"ETA {format_duration(report['eta'])}")
+    return " · ".join(parts)
+
+
+class JsonLinesSink:
+    """Appends a snapshot of all metrics as one JSON object per line"""
+
+    def __init__(self, path):
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def write(self, metrics):
+        self._file.write(json.dumps(metrics.snapshot()) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class PrometheusTextfileSink:
+    """Writes the metrics in the text format the node_exporter textfile collector reads.
+
+    The file is replaced atomically, so the collector never sees half of it.
+    """
+
+    def __init__(self, path, prefix='twitter_blocker_'):
+        self.path = path
+        self.prefix = prefix
+
+    def _lines(self, metrics):
+        typed = set()
+
+        def type_line(name, kind):
+            if name not in typed:
+                typed.add(name)
+                yield f"# TYPE {name} {kind}"
+
+        for (name, labels), value in sorted(metrics.counters().items()):
+            full_name = f"{self.prefix}{name}_total"
+            yield from type_line(full_name, 'counter')
+            yield f"{full_name}{{{_format_labels(labels)}}} {value}" if labels else f"{full_name} {value}"
+
+        for (name, labels), histogram in sorted(metrics.histograms().items()):
+            full_name = f"{self.prefix}{name}"
+            yield from type_line(full_name, 'histogram')
+            for bound, count in histogram.cumulative():
+                le = "+Inf" if bound == float('inf') else repr(bound)
+                yield f"{full_name}_bucket{{{_format_labels(labels + (('le', le),))}}} {count}"
+            label_text = f"{{{_format_labels(labels)}}}" if labels else ""
+            yield f"{full_name}_sum{label_text} {histogram.sum}"
+            yield f"{full_name}_count{label_text} {histogram.count}"
+
+        status = metrics.run_status()
+        if status is not None:
+            for key in ('expected', 'done', 'per_second', 'eta'):
+                if status[key] is not None:
+                    name = f"{self.prefix}run_{'eta_seconds' if key == 'eta' else key}"
+                    yield from type_line(name, 'gauge')
+                    yield f"{name} {status[key]}"
+
+    def write(self, metrics):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(self._lines(metrics)) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def close(self):
+        pass
@@ -0,0 +1,173 @@
+from contextlib import ExitStack
+import os
+import queue
+import re
+import threading
+
+from twitter import TwitterError
+
+from twitter_blocker import Blocker
+
+ACCOUNTS_DIRECTORY = "accounts"
+
+
+def account_db_path(name, directory=ACCOUNTS_DIRECTORY):
+    if not re.fullmatch(r"[A-Za-z0-9_.-]+", name):
+        raise ValueError(f"Invalid account name {name!r}, use letters, digits, _, . and -")
+    return os.path.join(directory, f"{name}.sqlite3")
+
+
+def list_accounts(directory=ACCOUNTS_DIRECTORY):
+    """Names of the registered accounts"""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(f[:-len(".sqlite3")] for f in os.listdir(directory) if f.endswith(".sqlite3"))
+
+
+def open_account(name, directory=ACCOUNTS_DIRECTORY, **kwargs):
+    """Returns a Blocker for the account that still has to be entered"""
+    os.makedirs(directory, exist_ok=True)
+    return Blocker(db_path=account_db_path(name, directory), **kwargs)
+
+
+class MultiAccountBlocker:
+    """Applies the same blocks to several accounts at once.
+
+    Every account is a Blocker with its own database, so it has its own credentials, rate limits and
+    current_block_run to resume from. The followers of a target are fetched once by the first account and
+    saved to the runs of all of them, then every account blocks in its own thread. Blocking all accounts takes
+    about as long as blocking one, as long as twitter doesn't limit the requests of the whole application.
+    """
+
+    def __init__(self, names, directory=ACCOUNTS_DIRECTORY, **kwargs):
+        if not names:
+            raise ValueError("At least one account is needed")
+        self.names = list(names)
+        self.blockers = {name: open_account(name, directory, **kwargs) for name in self.names}
+        # the metrics of the primary account, or of all of them if they share one instance
+        self.metrics = self.primary.metrics
+        if all(blocker.metrics is self.metrics for blocker in self.blockers.values()):
+            # every account blocks its share of the users left, the slowest one decides
+            self.metrics.eta_estimator = lambda remaining: max(
+                blocker.scheduler.estimate('blocks/create', remaining / len(self.blockers))
+                for blocker in self.blockers.values())
+        # successful blocks per account in the current run
+        self.progress = {name: 0 for name in self.names}
+        self._exit_stack = None
+
+    @property
+    def primary(self) -> Blocker:
+        """The account the followers are fetched with"""
+        return self.blockers[self.names[0]]
+
+    def __enter__(self):
+        with ExitStack() as stack:
+            for blocker in self.blockers.values():
+                stack.enter_context(blocker)
+            self._exit_stack = stack.pop_all()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return self._exit_stack.__exit__(exc_type, exc_val, exc_tb)
+
+    def unauthenticated_accounts(self):
+        return [name for name, blocker in self.blockers.items() if blocker.authenticated_user is None]
+
+    def get_user(self, screen_name=None, user_id=None):
+        return self.primary.get_user(screen_name=screen_name, user_id=user_id)
+
+    def get_block_counts(self):
+        return {name: blocker.get_block_count() for name, blocker in self.blockers.items()}
+
+    def get_last_run_info(self):
+        """(users left to process, reason) of every account"""
+        return {name: blocker.get_last_run_info() for name, blocker in self.blockers.items()}
+
+    def queue_target(self, user_id, reason):
+        """Queues a target on the primary account, block_queue fetches it and blocks it on all accounts"""
+        self.primary.queue_target(user_id, reason)
+        # the primary account never streams, continue_blocking blocks the target on all accounts
+        for blocker in self.blockers.values():
+            blocker._save_to_current_block_run(user_id, [], reason)
+
+    def _fetch_queued_targets(self):
+        """Fetches the unfetched targets of the primary account into the runs of every account.
+
+        The primary account keeps the cursor, it is committed only after the page is in all runs, so an
+        interrupted fetch continues where it stopped and a page is saved a second time at worst.
+        """
+        primary = self.primary
+        for user_id, reason, _ in primary.get_queued_targets(fetched=False):
+            try:
+                for _, next_cursor, page in primary._get_follower_pages(
+                        user_id, primary._get_target_cursor(user_id)):
+                    # the filter rules of the primary account apply to all, the users are only looked up once
+                    _, to_block = primary._apply_filter_rules(page)
+                    for blocker in self.blockers.values():
+                        if blocker is not primary:
+                            blocker._save_to_current_block_run(user_id, to_block, reason)
+                    # rolled back as a whole if this is interrupted, nothing else may commit half of it
+                    try:
+                        primary._save_target_cursor(user_id, next_cursor)
+                        primary._save_to_current_block_run(user_id, to_block, reason, commit=False)
+                        primary._db_connection.commit()
+                    except BaseException:
+                        primary._db_connection.rollback()
+                        raise
+            except TwitterError as e:
+                print(e)
+                continue
+            primary._mark_target_fetched(user_id)
+
+    def continue_blocking(self):
+        """Blocks what is left in the runs of all accounts in parallel and yields the sum of successful blocks"""
+        results = queue.Queue()
+        stop = threading.Event()
+
+        def block(name, blocker):
+            progress = blocker.continue_blocking()
+            try:
+                for count in progress:
+                    results.put((name, count))
+                    if stop.is_set():
+                        break
+            except Exception as e:
+                # the other accounts go on, this one can be resumed later
+                print(f"{name}: {e}")
+            finally:
+                progress.close()
+                results.put((name, None))
+
+        threads = [threading.Thread(target=block, args=item, name=f"blocker-{item[0]}", daemon=True)
+                   for item in self.blockers.items()]
+        for thread in threads:
+            thread.start()
+        running = len(threads)
+        try:
+            while running:
+                try:
+                    name, count = results.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                if count is None:
+                    running -= 1
+                    continue
+                self.progress[name] = count
+                yield sum(self.progress.values())
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    def block_queue(self):
+        """Fetches the queued targets once and blocks them on every account, see Blocker.block_queue"""
+        self.progress = {name: 0 for name in self.names}
+        self.metrics.begin_run()
+        try:
+            self._fetch_queued_targets()
+            yield from self.continue_blocking()
+        finally:
+            for blocker in self.blockers.values():
+                blocker.flush()
+            self.primary._remove_finished_targets()
+            self.metrics.end_run()
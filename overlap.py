@@ -0,0 +1,151 @@
+"""What blocking a target would do, before any of its followers is blocked.
+
+The followers are fetched once and kept in target_previews, then compared against everything that is blocked
+and against the follower snapshots of the targets blocked before. All of that is done on sorted numpy arrays,
+so even sets of ten million ids take seconds and not minutes.
+"""
+from datetime import datetime, timedelta
+import json
+
+import numpy as np
+
+from id_codec import decode_ids, encode_ids, isin_sorted
+
+# ids per followers/ids page
+FOLLOWER_PAGE_SIZE = 5000
+# requests per 15 minute window like twitter documents them, until a response told the real numbers
+DEFAULT_LIMITS = {'followers/ids': 15, 'users/lookup': 900}
+# followers and previews older than that are fetched and computed again
+PREVIEW_MAX_AGE = timedelta(days=1)
+
+
+def load_blocked_ids(blocker) -> np.ndarray:
+    """Sorted ids of everyone that is blocked, by this program or synced from twitter"""
+    blocked = np.fromiter(
+        (r[0] for r in blocker._db_connection.execute("select distinct user_id from blocked_users order by user_id;")),
+        dtype=np.int64)
+    synced = np.fromiter(
+        (r[0] for r in blocker._db_connection.execute("select user_id from synced_blocks order by user_id;")),
+        dtype=np.int64)
+    return np.union1d(blocked, synced)
+
+
+def load_snapshots(blocker):
+    """{parent_id: sorted follower ids} of every target that was fetched completely"""
+    return {parent_id: decode_ids(blob)
+            for parent_id, blob in blocker._db_connection.execute("select parent_id, ids from follower_snapshots;")}
+
+
+def _state(blocker):
+    """Changes whenever something a cached preview depends on changed"""
+    snapshots = blocker._cursor.execute("select count(*), max(snapshot_date) from follower_snapshots;").fetchone()
+    return f"{blocker.get_block_count()}:{blocker.get_synced_block_count()}:{snapshots[0]}:{snapshots[1]}"
+
+
+def cached_preview(blocker, user_id, max_age=PREVIEW_MAX_AGE):
+    """The last preview of user_id if nothing changed since, otherwise None"""
+    row = blocker._cursor.execute(
+        "select result from target_previews where parent_id = ? and state = ? and preview_date >= ?;",
+        [user_id, _state(blocker), datetime.utcnow() - max_age]).fetchone()
+    return dict(json.loads(row[0]), cached=True) if row is not None and row[0] is not None else None
+
+
+def get_follower_ids(blocker, user_id, refresh=False, max_age=PREVIEW_MAX_AGE):
+    """Sorted follower ids of user_id from an earlier preview if it is fresh enough, otherwise from twitter.
+
+    Snapshots only have the followers that were blocked, so they can't stand in for a fetch.
+    """
+    if not refresh:
+        row = blocker._cursor.execute(
+            "select ids from target_previews where parent_id = ? and fetch_date >= ?;",
+            [user_id, datetime.utcnow() - max_age]).fetchone()
+        if row is not None and row[0] is not None:
+            return decode_ids(row[0])
+    pages = [np.array(page, dtype=np.int64) for page in blocker.get_follower_ids(user_id)]
+    followers = np.unique(np.concatenate(pages)) if pages else np.empty(0, dtype=np.int64)
+    blocker._cursor.execute(
+        "insert into target_previews (parent_id, fetch_date, ids) values (?, ?, ?) "
+        "on conflict(parent_id) do update set fetch_date=excluded.fetch_date, ids=excluded.ids;",
+        [user_id, datetime.utcnow(), encode_ids(followers)])
+    blocker._db_connection.commit()
+    return followers
+
+
+def _estimate(blocker, calls):
+    """Seconds the calls take, by the rate limits and by the latencies measured so far"""
+    seconds = {}
+    histograms = blocker.metrics.histograms()
+    for endpoint, count in calls.items():
+        estimate = blocker.scheduler.estimate(endpoint, count, DEFAULT_LIMITS.get(endpoint))
+        latency = histograms.get(('api_request_seconds', (('endpoint', endpoint),)))
+        if latency is not None and latency.count:
+            workers = blocker.block_workers if endpoint == 'blocks/create' else 1
+            estimate = max(estimate, count * latency.mean() / workers)
+        seconds[endpoint] = round(estimate)
+    return seconds
+
+
+def preview_target(blocker, user_id, blocked_ids=None, snapshots=None, refresh=False):
+    """Returns a dict with what blocking user_id would do, cached until anything is blocked or a day passed.
+
+    blocked_ids from load_blocked_ids and snapshots from load_snapshots can be shared between the previews
+    of several targets. refresh fetches the followers again instead of using the ones of the last preview.
+    """
+    if not refresh:
+        cached = cached_preview(blocker, user_id)
+        if cached is not None:
+            return cached
+    state = _state(blocker)
+    followers = get_follower_ids(blocker, user_id, refresh)
+    if blocked_ids is None:
+        blocked_ids = load_blocked_ids(blocker)
+    if snapshots is None:
+        snapshots = load_snapshots(blocker)
+
+    already_blocked = int(np.count_nonzero(isin_sorted(followers, blocked_ids)))
+    new = len(followers) - already_blocked
+    overlaps = []
+    for parent_id, other in snapshots.items():
+        shared = int(np.count_nonzero(isin_sorted(followers, other))) if parent_id != user_id else 0
+        if shared:
+            overlaps.append({'parent_id': parent_id, 'shared': shared})
+    calls = {
+        'followers/ids': -(-len(followers) // FOLLOWER_PAGE_SIZE),
+        'blocks/create': new,
+        # the filter rules look up the users that are not blocked yet
+        'users/lookup': -(-new // 100) if blocker.filter_rules else 0,
+    }
+    seconds = _estimate(blocker, calls)
+    result = {
+        'user_id': user_id,
+        'follower_count': len(followers),
+        'already_blocked': already_blocked,
+        'new': new,
+        # followers shared with the targets fetched before, the most first
+        'overlaps': sorted(overlaps, key=lambda overlap: -overlap['shared']),
+        'api_calls': calls,
+        'seconds': seconds,
+        # fetching and blocking run at the same time, the slower one decides
+        'estimated_seconds': max(seconds.values()),
+    }
+    blocker._cursor.execute(
+        "insert into target_previews (parent_id, preview_date, state, result) values (?, ?, ?, ?) "
+        "on conflict(parent_id) do update set preview_date=excluded.preview_date, state=excluded.state, "
+        "result=excluded.result;", [user_id, datetime.utcnow(), state, json.dumps(result)])
+    blocker._db_connection.commit()
+    return dict(result, cached=False)
+
+
+def preview_targets(blocker, user_ids, refresh=False):
+    """Yields the preview of every target, the blocked ids and snapshots are loaded once for all of them"""
+    blocked_ids = None
+    snapshots = None
+    for user_id in user_ids:
+        cached = None if refresh else cached_preview(blocker, user_id)
+        if cached is not None:
+            yield cached
+            continue
+        if blocked_ids is None:
+            blocked_ids = load_blocked_ids(blocker)
+            snapshots = load_snapshots(blocker)
+        yield preview_target(blocker, user_id, blocked_ids, snapshots, refresh=refresh)
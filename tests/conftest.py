@@ -0,0 +1,61 @@
+import os
+import sys
+import threading
+
+import pytest
+
+# the modules live next to each other in the repository root, there is no package to install
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+
+@pytest.fixture
+def blocker(tmp_path, monkeypatch):
+    """A Blocker on an empty database that never talks to twitter"""
+    from twitter_blocker import Blocker
+
+    # the avatar cache lives in the working directory
+    monkeypatch.chdir(tmp_path)
+    with Blocker(defer_authentication=True, db_path=str(tmp_path / "blocker.sqlite3")) as b:
+        yield b
+
+
+@pytest.fixture
+def fake_server():
+    """benchmarks/fake_twitter_server.py in a thread, followers_N has N followers"""
+    from fake_twitter_server import FakeTwitterServer
+
+    server = FakeTwitterServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def api_blocker(fake_server, tmp_path, monkeypatch):
+    """An authenticated Blocker on an empty database that talks to fake_server"""
+    from twitter_blocker import Blocker
+
+    monkeypatch.chdir(tmp_path)
+    with Blocker(defer_authentication=True, base_url=fake_server.url,
+                 db_path=str(tmp_path / "blocker.sqlite3")) as b:
+        b.save_account_settings("key", "secret", "token", "token secret")
+        b.authenticate()
+        assert b.authenticated_user is not None
+        yield b
+
+
+@pytest.fixture
+def shared_followers(monkeypatch):
+    """The last 100 of the 300 followers of followers_300 follow followers_200 too"""
+    import fake_twitter_server
+
+    original = fake_twitter_server.follower_ids
+
+    def follower_ids(target_id, page):
+        ids = original(target_id, page)
+        return ids[:200] + original(200, 0)[:100] if target_id == 300 else ids
+
+    monkeypatch.setattr(fake_twitter_server, 'follower_ids', follower_ids)
@@ -0,0 +1,39 @@
+import threading
+
+import fake_twitter_server
+
+
+def queue(b, *screen_names):
+    targets = [b.get_user(screen_name=screen_name) for screen_name in screen_names]
+    for target in targets:
+        b.queue_target(target.twitter_id, "r")
+    return targets
+
+
+def test_shared_followers_are_blocked_once(api_blocker, fake_server, shared_followers):
+    small, big = queue(api_blocker, "followers_200", "followers_300")
+    assert list(api_blocker.block_queue())[-1] == 502
+    assert fake_server.stats['blocks/create'] == 402
+    assert api_blocker.get_parent_block_count(small.twitter_id) == 200
+    assert api_blocker.get_parent_block_count(big.twitter_id) == 300
+
+
+def test_interrupted_target_resumes_at_its_cursor(api_blocker, fake_server):
+    # one page of followers every 2 seconds, the run is stopped while it waits for the second one
+    fake_server.limits['followers/ids'] = fake_twitter_server.EndpointLimit(1, 2)
+    target, = queue(api_blocker, "followers_5001")
+    progress = api_blocker.block_queue()
+    for _ in progress:
+        if api_blocker._get_target_cursor(target.twitter_id) != -1:
+            break
+    progress.close()
+    for thread in threading.enumerate():
+        if thread.name == "follower-fetcher":
+            thread.join()
+
+    fetched = fake_server.stats['followers/ids']
+    assert list(api_blocker.block_queue())[-1] == 5002
+    # the first page is not fetched again
+    assert fake_server.stats['followers/ids'] - fetched == 1
+    assert api_blocker.get_parent_block_count(target.twitter_id) == 5001
+    assert len(fake_server.blocked_ids) == 5002
@@ -0,0 +1,73 @@
+from datetime import datetime
+
+
+def assert_counts_match(b):
+    cursor = b._db_connection.cursor()
+    assert b.get_block_count() == cursor.execute("select count(distinct user_id) from blocked_users;").fetchone()[0]
+    parents = cursor.execute(
+        "select parent_id, count(*) from blocked_users where parent_id is not null group by parent_id;").fetchall()
+    for parent_id, count in parents:
+        assert b.get_parent_block_count(parent_id) == count
+    stale = cursor.execute(
+        "select id from block_stats where scope = 'parent' and block_count != 0 "
+        "and id not in (select parent_id from blocked_users where parent_id is not null);").fetchall()
+    assert stale == []
+
+
+def block(b, user_id, parent_id, reason="r"):
+    b._buffer_block_result(user_id, f"user{user_id}", parent_id, reason, datetime.utcnow(), True)
+
+
+def test_inserts(blocker):
+    block(blocker, 1, None)
+    for user_id in (10, 11, 12):
+        block(blocker, user_id, 1)
+    # a follower of two targets is one blocked user
+    block(blocker, 2, None)
+    block(blocker, 11, 2)
+    blocker.flush()
+    assert blocker.get_block_count() == 5
+    assert blocker.get_parent_block_count(1) == 3
+    assert blocker.get_parent_block_count(2) == 1
+    assert_counts_match(blocker)
+
+
+def test_upserts_count_once(blocker):
+    block(blocker, 1, None)
+    block(blocker, 10, 1)
+    blocker.flush()
+    block(blocker, 1, None, "again")
+    block(blocker, 10, 1, "again")
+    blocker.flush()
+    # linking the blocked users to another target only adds rows of that target
+    linked, remaining = blocker._filter_already_blocked(3, [10, 1, 99], "r", datetime.utcnow())
+    blocker._db_connection.commit()
+    assert (linked, list(remaining)) == (2, [99])
+    assert blocker.get_block_count() == 2
+    assert blocker.get_parent_block_count(1) == 1
+    assert blocker.get_parent_block_count(3) == 2
+    assert_counts_match(blocker)
+
+
+def test_deletes(blocker):
+    block(blocker, 1, None)
+    block(blocker, 2, None)
+    for user_id in (10, 11):
+        block(blocker, user_id, 1)
+        block(blocker, user_id, 2)
+    blocker.flush()
+    # removing one of two rows of a user keeps it blocked
+    blocker._db_connection.execute("delete from blocked_users where user_id = 10 and parent_id = 1;")
+    assert blocker.get_block_count() == 4
+    assert_counts_match(blocker)
+    # an unblock goes through the buffer like a block
+    blocker._db_connection.execute(
+        "insert into current_unblock_run (user_id, parent_id) values (11, 1), (11, 2);")
+    blocker._buffer_unblock_result(11, True)
+    blocker.flush()
+    assert blocker.get_block_count() == 3
+    assert blocker.get_parent_block_count(2) == 1
+    assert_counts_match(blocker)
+    blocker._db_connection.execute("delete from blocked_users;")
+    assert blocker.get_block_count() == 0
+    assert_counts_match(blocker)
@@ -0,0 +1,50 @@
+import io
+import random
+
+import pytest
+
+import blocklist_io
+
+
+def test_binary_round_trip():
+    ids = [1, 5, 300, 2 ** 40, 2 ** 62]
+    out = io.BytesIO()
+    blocklist_io.write_binary(out, ids, {'parent_id': 7, 'reason': "spam"})
+    f = io.BufferedReader(io.BytesIO(out.getvalue()))
+    assert blocklist_io.is_binary(f)
+    metadata, read_ids = blocklist_io.read_binary(f)
+    assert metadata == {'parent_id': 7, 'reason': "spam"}
+    assert list(read_ids) == ids
+
+
+def test_binary_round_trip_bigger_than_a_read():
+    ids = sorted(random.Random(0).sample(range(2 ** 40), 100000))
+    out = io.BytesIO()
+    blocklist_io.write_binary(out, ids, {})
+    assert len(out.getvalue()) > blocklist_io.READ_SIZE
+    _, read_ids = blocklist_io.read_binary(io.BufferedReader(io.BytesIO(out.getvalue())))
+    assert list(read_ids) == ids
+
+
+def test_read_binary_rejects_other_files():
+    with pytest.raises(ValueError):
+        blocklist_io.read_binary(io.BytesIO(b"user_id\n1\n"))
+
+
+def test_csv_round_trip():
+    rows = [(1, "a", 7, "spam", "2022-01-01 00:00:00"), (2, "b", None, None, "2022-01-02 00:00:00")]
+    out = io.StringIO()
+    blocklist_io.write_csv(out, rows)
+    assert not blocklist_io.is_binary(io.BufferedReader(io.BytesIO(out.getvalue().encode('utf-8'))))
+    assert list(blocklist_io.read_csv(io.StringIO(out.getvalue()))) == [(1, 7, "spam"), (2, None, None)]
+
+
+def test_csv_only_needs_user_id():
+    assert list(blocklist_io.read_csv(io.StringIO("user_id\n3\n4\n"))) == [(3, None, None), (4, None, None)]
+
+
+def test_csv_errors():
+    with pytest.raises(ValueError):
+        list(blocklist_io.read_csv(io.StringIO("id,reason\n1,spam\n")))
+    with pytest.raises(ValueError, match="Line 3"):
+        list(blocklist_io.read_csv(io.StringIO("user_id,parent_id\n1,2\n1,x\n")))
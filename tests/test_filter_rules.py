@@ -0,0 +1,17 @@
+from filter_rules import FilterRules
+
+
+def test_filtered_followers_are_not_blocked(api_blocker, fake_server):
+    target = api_blocker.get_user(screen_name="followers_2000")
+    followers = [user_id for page in api_blocker.get_follower_ids(target.twitter_id) for user_id in page]
+    allowed = followers[0]
+    # the fake API makes every 50th user verified, every 20th a journalist and every 1000th suspended
+    api_blocker.filter_rules = FilterRules(allow=[f"@USER_{allowed}"], skip_verified=True,
+                                           skip_keywords=["Journalist"])
+    api_blocker.queue_target(target.twitter_id, "r")
+    list(api_blocker.block_queue())
+
+    expected = {user_id for user_id in followers[1:] if user_id % 50 and user_id % 20}
+    assert fake_server.stats['users/lookup'] > 0
+    assert fake_server.blocked_ids == expected | {target.twitter_id}
+    assert api_blocker.get_parent_block_count(target.twitter_id) == len(expected)
@@ -0,0 +1,75 @@
+import zlib
+
+import numpy as np
+import pytest
+
+from id_codec import decode_ids, encode_ids, isin_sorted, iter_decode, iter_decode_arrays, iter_encode_sorted
+
+
+def random_ids(count, seed=0):
+    rng = np.random.default_rng(seed)
+    # small and huge ids and everything between, deltas of one to ten varint bytes
+    return np.concatenate((rng.integers(0, 1 << 20, count // 2), rng.integers(0, 1 << 62, count - count // 2)))
+
+
+def reference_encode(sorted_ids):
+    """The format as it is documented, one varint per delta, written the slow way"""
+    out = bytearray()
+    previous = 0
+    for user_id in sorted_ids:
+        delta = user_id - previous
+        previous = user_id
+        while True:
+            byte = delta & 0x7f
+            delta >>= 7
+            out.append(byte | (0x80 if delta else 0))
+            if not delta:
+                break
+    return zlib.compress(bytes(out))
+
+
+def test_round_trip_sorts_and_drops_duplicates():
+    ids = random_ids(10000)
+    ids = np.concatenate((ids, ids[:100]))
+    assert np.array_equal(decode_ids(encode_ids(ids)), np.unique(ids))
+
+
+def test_empty():
+    assert len(decode_ids(encode_ids([]))) == 0
+    assert list(iter_decode([encode_ids([])])) == []
+
+
+def test_known_format():
+    ids = sorted(set(random_ids(1000).tolist()))
+    assert decode_ids(reference_encode(ids)).tolist() == ids
+    assert decode_ids(encode_ids(ids)).tolist() == ids
+
+
+def test_iter_encode_sorted_in_chunks():
+    ids = np.unique(random_ids(1000))
+    blob = b"".join(iter_encode_sorted(iter(ids.tolist()), chunk_size=7))
+    assert np.array_equal(decode_ids(blob), ids)
+
+
+def test_iter_encode_sorted_rejects_unsorted_ids():
+    with pytest.raises(ValueError):
+        b"".join(iter_encode_sorted([1, 3, 2]))
+    # across two chunks too
+    with pytest.raises(ValueError):
+        b"".join(iter_encode_sorted([1, 3, 2], chunk_size=2))
+
+
+def test_iter_decode_pieces_split_anywhere():
+    ids = np.unique(random_ids(5000))
+    blob = encode_ids(ids)
+    for size in (1, 3, 1000):
+        pieces = [blob[i:i + size] for i in range(0, len(blob), size)]
+        assert list(iter_decode(pieces)) == ids.tolist()
+    assert np.array_equal(np.concatenate(list(iter_decode_arrays([blob]))), ids)
+
+
+def test_isin_sorted():
+    sorted_ids = np.array([2, 5, 9], dtype=np.int64)
+    ids = np.array([1, 2, 5, 6, 9, 10], dtype=np.int64)
+    assert isin_sorted(ids, sorted_ids).tolist() == [False, True, True, False, True, False]
+    assert not isin_sorted(ids, np.empty(0, dtype=np.int64)).any()
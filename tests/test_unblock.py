@@ -0,0 +1,14 @@
+def test_shared_followers_stay_blocked(api_blocker, fake_server, shared_followers):
+    small, big = [api_blocker.get_user(screen_name=name) for name in ("followers_200", "followers_300")]
+    for target in (small, big):
+        api_blocker.queue_target(target.twitter_id, "r")
+    list(api_blocker.block_queue())
+    small_followers = {user_id for page in api_blocker.get_follower_ids(small.twitter_id) for user_id in page}
+
+    assert api_blocker.queue_unblock(parent_id=big.twitter_id) == 301
+    assert list(api_blocker.continue_unblocking())[-1] == 201
+    assert fake_server.stats['blocks/destroy'] == 201
+    assert fake_server.blocked_ids == small_followers | {small.twitter_id}
+    assert api_blocker.get_parent_block_count(big.twitter_id) == 0
+    assert api_blocker.get_parent_block_count(small.twitter_id) == 200
+    assert api_blocker.get_unblock_count() == 0
@@ -0,0 +1,49 @@
+from datetime import datetime
+import os
+import signal
+import sqlite3
+
+import pytest
+
+
+def follower_ids(b, user_id):
+    return {user_id for page in b.get_follower_ids(user_id) for user_id in page}
+
+
+def test_results_wait_in_the_buffer(blocker):
+    blocker.flush_rows = 10
+    blocker.flush_interval = 60
+    # another connection only sees what was committed
+    reader = sqlite3.connect(blocker.db_path)
+
+    def rows():
+        return reader.execute("select count(*) from blocked_users;").fetchone()[0]
+
+    for user_id in range(1, 10):
+        blocker._buffer_block_result(user_id, f"user{user_id}", None, "r", datetime.utcnow(), True)
+    assert rows() == 0
+    blocker._buffer_block_result(10, "user10", None, "r", datetime.utcnow(), True)
+    assert rows() == 10
+    blocker._buffer_block_result(11, "user11", None, "r", datetime.utcnow(), True)
+    blocker.flush_interval = 0
+    blocker._flush_if_due()
+    assert rows() == 11
+
+
+def test_interrupted_run_resumes(api_blocker, fake_server):
+    # nothing is written on time, only what the finally blocks flush is there after the interruption
+    api_blocker.flush_rows = 100000
+    api_blocker.flush_interval = 3600
+    target = api_blocker.get_user(screen_name="followers_2000")
+    api_blocker.queue_target(target.twitter_id, "r")
+    with pytest.raises(KeyboardInterrupt):
+        for count in api_blocker.block_queue():
+            if count >= 500:
+                os.kill(os.getpid(), signal.SIGINT)
+    assert api_blocker.get_block_count() >= 500
+
+    assert list(api_blocker.block_queue())[-1] == 2001
+    assert fake_server.blocked_ids == follower_ids(api_blocker, target.twitter_id) | {target.twitter_id}
+    assert api_blocker.get_parent_block_count(target.twitter_id) == 2000
+    # only the blocks that were in flight when it stopped are sent again
+    assert fake_server.stats['blocks/create'] <= 2001 + api_blocker.block_workers
@@ -1,10 +1,46 @@
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from typing import Generator
+import numpy as np
 import twitter
 from twitter import TwitterError
-from datetime import datetime
-from PIL import Image
-import requests
+from twitter.ratelimit import RateLimit
+from datetime import datetime, timedelta
+from itertools import chain, groupby
+import io
+import json
+import queue
+import signal
 import sqlite3
+import threading
+import time
+
+from avatar_cache import AvatarCache
+import blocklist_io
+from filter_rules import FilterRules
+from id_codec import decode_ids, encode_ids, isin_sorted
+from metrics import Metrics
+
+
+def twitter_error_code(twitter_error):
+    """The error code Twitter sent or None if it's not that kind of error"""
+    try:
+        return twitter_error.args[0][0]['code']
+    except (IndexError, KeyError, TypeError):
+        return None
+
+
+# "User not found." from users/show
+USER_NOT_FOUND_CODE = 50
+# "Sorry, that page does not exist." for users that are gone
+PAGE_NOT_FOUND_CODE = 34
+# "No user matches for specified terms." from users/lookup when none of the users exists anymore
+NO_USER_MATCHES_CODE = 17
+# users/lookup takes at most that many ids
+LOOKUP_BATCH_SIZE = 100
+# user metadata older than that is looked up again before the filter rules are checked
+USER_METADATA_MAX_AGE = timedelta(days=7)
 
 
 class UserSuspendedError(Exception):
@@ -15,14 +51,20 @@ class UserSuspendedError(Exception):
 
     @staticmethod
     def is_this_error(twitter_error):
-        return twitter_error.args[0][0]['code'] == 63
+        return twitter_error_code(twitter_error) == 63
+
+
+def profile_pic_url(twitter_user):
+    # normal image is too small and looks ugly
+    return twitter_user.profile_image_url_https.replace('_normal.', '_400x400.')
 
 
 class UserWrapper:
-    def __init__(self, twitter_user):
-        # normal image is too small and looks ugly
-        url = twitter_user.profile_image_url_https.replace('_normal.', '_400x400.')
-        self.profile_pic = Image.open(requests.get(url, stream=True).raw)
+    def __init__(self, twitter_user, profile_pic=None, avatar_cache=None):
+        # the picture is only downloaded when something shows it, headless runs never need it
+        self._profile_pic = profile_pic
+        self._profile_pic_url = profile_pic_url(twitter_user)
+        self._avatar_cache = avatar_cache
 
         self.display_name = twitter_user.name
         self.screen_name = twitter_user.screen_name
@@ -30,19 +72,233 @@ class UserWrapper:
         self.twitter_id = twitter_user.id
         self.follower_count = twitter_user.followers_count
 
+    @property
+    def profile_pic(self):
+        if self._profile_pic is None:
+            # imported here so the headless command line doesn't pay for them on startup
+            from io import BytesIO
+            from PIL import Image
+            if self._avatar_cache is not None:
+                self._profile_pic = Image.open(BytesIO(self._avatar_cache.get(self._profile_pic_url)))
+            else:
+                import requests
+                self._profile_pic = Image.open(requests.get(self._profile_pic_url, stream=True).raw)
+        return self._profile_pic
+
+    def cached_profile_pic(self):
+        """The picture if it is already loaded or on disk, never downloads anything"""
+        if self._profile_pic is None and self._avatar_cache is not None:
+            content = self._avatar_cache.cached(self._profile_pic_url)
+            if content is not None:
+                from io import BytesIO
+                from PIL import Image
+                self._profile_pic = Image.open(BytesIO(content))
+        return self._profile_pic
+
+
+class UserCache:
+    """Remembers looked up users by id and by screen name for a while, including the ones that don't exist.
+
+    Entries expire after ttl seconds, not found and suspended users after negative_ttl. When there are more
+    than max_size entries the least recently used are dropped.
+    """
+
+    def __init__(self, ttl=15 * 60, negative_ttl=5 * 60, max_size=256):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _keys(screen_name=None, user_id=None):
+        keys = []
+        if user_id:
+            keys.append(('id', int(user_id)))
+        if screen_name:
+            # screen names are case insensitive on twitter
+            keys.append(('screen_name', screen_name.lower()))
+        return keys
+
+    def get(self, screen_name=None, user_id=None):
+        """Returns (True, value) on a hit and (False, None) otherwise.
+
+        value is a UserWrapper, None for users that don't exist or the UserSuspendedError for suspended ones.
+        """
+        now = time.monotonic()
+        with self._lock:
+            for key in self._keys(screen_name, user_id):
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                expires, value = entry
+                if expires < now:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                return True, value
+        return False, None
+
+    def put(self, value, screen_name=None, user_id=None):
+        if isinstance(value, UserWrapper):
+            screen_name, user_id = value.screen_name, value.twitter_id
+        expires = time.monotonic() + (self.ttl if isinstance(value, UserWrapper) else self.negative_ttl)
+        with self._lock:
+            for key in self._keys(screen_name, user_id):
+                self._entries[key] = (expires, value)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
 
 def result_or_none(r):
     return r if r is None else r[0]
 
 
+# put into the page queue by the follower fetching thread when it is done
+_FETCH_DONE = object()
+_FETCH_FAILED = object()
+
+
+class RateLimitScheduler:
+    """Keeps track of the rate limit window of every endpoint and lets callers wait for one endpoint only.
+
+    python-twitter's sleep_on_rate_limit puts the calling thread to sleep inside the library, with this only
+    the threads that need the exhausted endpoint wait and everybody else can see until when.
+    The windows are learned from the rate limit headers of the responses.
+    """
+
+    RATE_LIMIT_EXCEEDED_CODE = 88
+
+    def __init__(self, window=15 * 60):
+        # twitter's windows are 15 minutes, needed to estimate how long more requests than remaining take
+        self.window = window
+        self._condition = threading.Condition()
+        # endpoint -> [limit, remaining, reset]
+        self._windows = {}
+
+    def update(self, endpoint, limit, remaining, reset):
+        """Takes the values from the headers of a response"""
+        if not limit:
+            return
+        with self._condition:
+            window = self._windows.get(endpoint)
+            if window is None or reset != window[2] or time.time() >= window[2]:
+                self._windows[endpoint] = [limit, remaining, reset]
+            else:
+                # responses of concurrent requests can arrive out of order
+                window[1] = min(window[1], remaining)
+            self._condition.notify_all()
+
+    def exhausted(self, endpoint, reset=None):
+        """Twitter said the limit is used up, maybe before we knew"""
+        with self._condition:
+            window = self._windows.get(endpoint)
+            if reset is None or reset <= time.time():
+                reset = window[2] if window and window[2] > time.time() else time.time() + self.window
+            self._windows[endpoint] = [window[0] if window else 15, 0, reset]
+
+    def resume_time(self, endpoint):
+        """Epoch time at which the endpoint can be used again, None if it can be used right now"""
+        with self._condition:
+            window = self._windows.get(endpoint)
+            if window is None or window[1] > 0 or time.time() >= window[2]:
+                return None
+            return window[2]
+
+    def resume_times(self):
+        """{endpoint: epoch time} of all endpoints that are exhausted at the moment"""
+        with self._condition:
+            endpoints = list(self._windows)
+        return {endpoint: t for endpoint in endpoints if (t := self.resume_time(endpoint)) is not None}
+
+    def acquire(self, endpoint):
+        """Waits until the endpoint can be used and takes one request of its window, returns the seconds waited"""
+        start = time.monotonic()
+        with self._condition:
+            while True:
+                window = self._windows.get(endpoint)
+                now = time.time()
+                if window is not None and now >= window[2]:
+                    # a new window started, the next response tells the exact values
+                    window[1] = window[0]
+                    window[2] = now + self.window
+                if window is None or window[1] > 0:
+                    if window is not None:
+                        window[1] -= 1
+                    return time.monotonic() - start
+                # a second more because twitter's clock and ours are never exactly the same
+                self._condition.wait(min(window[2] - now + 1, 60))
+
+    def estimate(self, endpoint, requests, default_limit=None):
+        """Seconds until requests more calls of the endpoint went through, going by the rate limit alone.
+
+        default_limit is taken for endpoints that weren't called yet, without one they count as unlimited.
+        """
+        now = time.time()
+        with self._condition:
+            window = self._windows.get(endpoint)
+            if window is None and default_limit:
+                window = [default_limit, default_limit, now + self.window]
+            if window is None or requests <= 0:
+                return 0
+            limit, remaining, reset = window
+        if now >= reset:
+            remaining, reset = limit, now + self.window
+        if requests <= remaining:
+            return 0
+        windows = -(-(requests - remaining) // limit)
+        return reset - now + (windows - 1) * self.window
+
+    def summary(self):
+        return ", ".join(f"{endpoint} resumes at {datetime.fromtimestamp(t).strftime('%H:%M:%S')}"
+                         for endpoint, t in sorted(self.resume_times().items()))
+
+
 class Blocker:
-    def __init__(self):
+    def __init__(self, flush_rows=200, flush_interval=2.0, block_workers=4, defer_authentication=False,
+                 base_url=None, metrics=None, db_path="twitter_blocker.sqlite3", filter_rules=None):
         self.api = None
+        # every account has its own database, see multi_account.py
+        self.db_path = db_path
+        # counters and latencies of everything below, see metrics.py for the sinks they can be written to
+        self.metrics = metrics if metrics is not None else Metrics()
+        # None is the real twitter API, benchmarks point it to benchmarks/fake_twitter_server.py
+        self.base_url = base_url
         self.authenticated_user = None
+        # with deferred authentication the account from the last session is used until authenticate() is called,
+        # so a GUI can show up without waiting for twitter
+        self.defer_authentication = defer_authentication
+        self.avatar_cache = None
+        self.user_cache = UserCache()
+        # followers that match these are not blocked, without rules nobody is looked up
+        self.filter_rules = filter_rules if filter_rules is not None else FilterRules()
+        # how many CreateBlock requests can be in flight at once
+        self.block_workers = block_workers
+        self.scheduler = RateLimitScheduler()
+        # the pace alone doesn't know that the rate limit is going to stop the run for a while
+        self.metrics.eta_estimator = lambda remaining: self.scheduler.estimate('blocks/create', remaining)
+        # block results are committed in batches of flush_rows or every flush_interval seconds,
+        # whatever comes first. A crash loses at most one batch and those users just get blocked again on resume.
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self._pending_blocks = []
+        self._pending_unblocks = []
+        self._pending_since = None
+        self._db_lock = threading.RLock()
+        self._previous_signal_handlers = {}
 
     def __enter__(self):
-        self._db_connection = sqlite3.connect("twitter_blocker.sqlite3", check_same_thread=False)
+        self._db_connection = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.avatar_cache = AvatarCache()
         self._cursor = self._db_connection.cursor()
+        # WAL only needs an fsync on checkpoints instead of on every commit
+        self._cursor.execute("pragma journal_mode=wal;")
+        self._cursor.execute("pragma synchronous=normal;")
         self._cursor.execute(
             """create table if not exists blocked_users (
                 user_id integer, 
@@ -60,47 +316,346 @@ class Blocker:
                 PRIMARY KEY(user_id, parent_id)
             );""")
         self._cursor.execute("create table if not exists user_data (key text primary key, value);")
+        # targets waiting to be fetched and blocked, their followers end up in current_block_run
+        self._cursor.execute(
+            """create table if not exists block_targets (
+                position integer primary key, 
+                parent_id integer unique, 
+                reason, 
+                fetched integer default 0, 
+                next_cursor integer default -1
+            );""")
+        self._add_column_if_missing('block_targets', 'next_cursor', 'integer default -1')
+        # older databases kept the pages of unfinished fetches for the snapshots, those come from blocked_users now
+        self._cursor.execute("drop table if exists follower_pages;")
+        self._cursor.execute("create index if not exists blocked_users_parent_id on blocked_users (parent_id);")
+        self._cursor.execute(
+            "create index if not exists current_block_run_parent_id on current_block_run (parent_id);")
+        # blocked_users rows that are going to be undone, see queue_unblock
+        self._cursor.execute(
+            """create table if not exists current_unblock_run (
+                user_id integer, 
+                parent_id integer, 
+                PRIMARY KEY(user_id, parent_id)
+            );""")
+        self._create_block_stats()
+        # blocks that exist on the account, no matter if they were made by this application or not
+        self._cursor.execute(
+            """create table if not exists synced_blocks (
+                user_id integer primary key, 
+                sync_date datetime
+            );""")
+        # the followers of each target that were blocked or linked to it, see id_codec for the format
+        self._cursor.execute(
+            """create table if not exists follower_snapshots (
+                parent_id integer primary key, 
+                snapshot_date datetime, 
+                follower_count integer, 
+                ids blob
+            );""")
+        # what users/lookup said about the followers, for the filter rules. found is 0 for deleted and suspended ones
+        self._cursor.execute(
+            """create table if not exists user_metadata (
+                user_id integer primary key, 
+                screen_name, 
+                followers_count integer, 
+                verified integer, 
+                following integer, 
+                description, 
+                found integer, 
+                lookup_date datetime
+            );""")
+        # followers of targets that were only previewed and the numbers of the preview, see overlap.py
+        self._cursor.execute(
+            """create table if not exists target_previews (
+                parent_id integer primary key, 
+                fetch_date datetime, 
+                ids blob, 
+                preview_date datetime, 
+                state text, 
+                result text
+            );""")
+        # scratch table to diff a whole batch of follower ids against blocked_users in one query
+        self._cursor.execute(
+            """create temp table if not exists block_candidates (
+                position integer primary key, 
+                user_id integer
+            );""")
+        # everyone that doesn't need a CreateBlock call anymore, synced blocks have no user name
+        self._cursor.execute(
+            """create temp view if not exists known_blocks as 
+                select user_id, max(user_name) as user_name from blocked_users group by user_id 
+                union all 
+                select user_id, null from synced_blocks where user_id not in (select user_id from blocked_users);""")
         self._db_connection.commit()
+        self._install_signal_handlers()
 
-        self.authenticate()
+        if self.defer_authentication:
+            self._create_api()
+            self.authenticated_user = self.get_cached_account()
+        else:
+            self.authenticate()
         return self
 
+    def _add_column_if_missing(self, table, column, definition):
+        # create table if not exists leaves the tables of older databases like they are
+        columns = [r[1] for r in self._cursor.execute(f"pragma table_info({table});").fetchall()]
+        if column not in columns:
+            self._cursor.execute(f"alter table {table} add column {column} {definition};")
+
+    def _create_block_stats(self):
+        """Counters for blocked_users that triggers keep up to date in the same transaction as the blocks.
+
+        scope 'account' with id 0 counts the distinct blocked users, scope 'parent' counts the blocked followers
+        of each target. Reading them is O(1) instead of scanning the whole table.
+        """
+        self._cursor.execute(
+            """create table if not exists block_stats (
+                scope text, 
+                id integer, 
+                block_count integer not null, 
+                PRIMARY KEY(scope, id)
+            );""")
+        self._cursor.execute(
+            """create trigger if not exists block_stats_insert after insert on blocked_users begin
+                insert into block_stats (scope, id, block_count) 
+                    select 'account', 0, 1 
+                    where (select count(*) from blocked_users where user_id = new.user_id) = 1 
+                    on conflict(scope, id) do update set block_count = block_count + 1;
+                insert into block_stats (scope, id, block_count) 
+                    select 'parent', new.parent_id, 1 
+                    where new.parent_id is not null 
+                    on conflict(scope, id) do update set block_count = block_count + 1;
+            end;""")
+        self._cursor.execute(
+            """create trigger if not exists block_stats_delete after delete on blocked_users begin
+                update block_stats set block_count = block_count - 1 
+                    where scope = 'account' and id = 0 
+                    and not exists (select 1 from blocked_users where user_id = old.user_id);
+                update block_stats set block_count = block_count - 1 
+                    where scope = 'parent' and id = old.parent_id;
+            end;""")
+        if self._cursor.execute("select 1 from block_stats limit 1;").fetchone() is None:
+            # databases from before the counters existed
+            self._cursor.execute(
+                "insert into block_stats (scope, id, block_count) "
+                "select 'account', 0, count(distinct user_id) from blocked_users;")
+            self._cursor.execute(
+                "insert into block_stats (scope, id, block_count) "
+                "select 'parent', parent_id, count(*) from blocked_users where parent_id is not null group by parent_id;")
+
     def __exit__(self, exc_type, exc_val, exc_tb):
+        self.flush()
+        self._restore_signal_handlers()
+        self.metrics.close()
         self._db_connection.close()
+        self.avatar_cache.close()
+
+    def _install_signal_handlers(self):
+        # signal handlers can only be set from the main thread
+        if threading.current_thread() is not threading.main_thread():
+            return
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            self._previous_signal_handlers[signum] = signal.signal(signum, self._handle_signal)
+
+    def _restore_signal_handlers(self):
+        for signum, handler in self._previous_signal_handlers.items():
+            signal.signal(signum, handler)
+        self._previous_signal_handlers.clear()
+
+    def _handle_signal(self, signum, frame):
+        # this can run in the middle of anything, so it only raises and leaves the flushing to the finally blocks
+        # around the runs, SIGINT raises KeyboardInterrupt through python's own handler
+        previous = self._previous_signal_handlers.get(signum)
+        if callable(previous):
+            previous(signum, frame)
+        elif previous != signal.SIG_IGN:
+            raise SystemExit(128 + signum)
+
+    def flush(self):
+        """Writes all buffered block results to the database"""
+        with self._db_lock:
+            pending, self._pending_blocks = self._pending_blocks, []
+            unblocks, self._pending_unblocks = self._pending_unblocks, []
+            pending_since, self._pending_since = self._pending_since, None
+            if not pending and not unblocks:
+                return
+            try:
+                self._write_results(pending, unblocks)
+            except BaseException:
+                # an interrupted flush leaves nothing half written, the results are written by the next one
+                self._db_connection.rollback()
+                self._pending_blocks[:0] = pending
+                self._pending_unblocks[:0] = unblocks
+                self._pending_since = pending_since
+                raise
+
+    def _flush_if_due(self):
+        """Flushes if flush_rows results are buffered or the oldest one waited flush_interval seconds"""
+        with self._db_lock:
+            if len(self._pending_blocks) + len(self._pending_unblocks) >= self.flush_rows \
+                    or self._pending_since is not None \
+                    and time.monotonic() - self._pending_since >= self.flush_interval:
+                self.flush()
+
+    def _write_results(self, pending, unblocks):
+        self._db_connection.executemany(
+            """
+            insert into blocked_users (
+                user_id, 
+                user_name, 
+                parent_id, 
+                reason, 
+                block_date
+            ) 
+            values (?, ?, ?, ?, ?) 
+            on conflict(user_id, parent_id) do 
+                update set user_name=coalesce(excluded.user_name, user_name)""",
+            (p[:5] for p in pending if p[5] and p[2] is not None))
+        self._insert_parentless(
+            'blocked_users', ('user_name', 'reason', 'block_date'),
+            ((p[0], p[1], p[3], p[4]) for p in pending if p[5] and p[2] is None))
+        self._db_connection.executemany(
+            "delete from current_block_run where user_id = ? and parent_id is ?;",
+            ((p[0], p[2]) for p in pending))
+        # only the queued rows go, continue_unblocking made sure those are all the user has
+        self._db_connection.executemany(
+            """
+            delete from blocked_users where user_id = ? and exists (
+                select 1 from current_unblock_run u 
+                where u.user_id = blocked_users.user_id and u.parent_id is blocked_users.parent_id
+            )""",
+            ((u[0],) for u in unblocks if u[1]))
+        self._db_connection.executemany(
+            "delete from synced_blocks where user_id = ?;", ((u[0],) for u in unblocks if u[1]))
+        self._db_connection.executemany(
+            "delete from current_unblock_run where user_id = ?;", ((u[0],) for u in unblocks))
+        with self.metrics.timer('db_commit_seconds'):
+            self._db_connection.commit()
+
+    def _insert_parentless(self, table, columns, rows):
+        """Inserts (user_id, *columns) rows with a null parent_id into table, users that have such a row are skipped.
+
+        null never conflicts in the primary key, so these rows can't be upserted like the ones with a parent.
+        """
+        self._db_connection.executemany(
+            f"insert into {table} (user_id, parent_id, {', '.join(columns)}) "
+            f"select ?, null, {', '.join('?' * len(columns))} "
+            f"where not exists (select 1 from {table} where user_id = ? and parent_id is null);",
+            ((*row, row[0]) for row in rows))
+
+    def _buffer_block_result(self, user_id, user_name, parent_id, reason, date, success):
+        """Queues the outcome of a block, failed blocks are only removed from current_block_run"""
+        with self._db_lock:
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+            # blocks synced from twitter have no user_name, so success needs its own field
+            self._pending_blocks.append((user_id, user_name, parent_id, reason, date, success))
+            self._flush_if_due()
+
+    def _buffer_unblock_result(self, user_id, success):
+        """Queues the outcome of an unblock, failed ones are only removed from current_unblock_run"""
+        with self._db_lock:
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+            self._pending_unblocks.append((user_id, success))
+            self._flush_if_due()
+
+    def _create_api(self):
+        # creating the Api doesn't send any request yet
+        # the rate limits are handled by self.scheduler, so only the threads that need an exhausted endpoint wait
+        self.api = twitter.Api(**self.get_account_settings(), base_url=self.base_url)
 
     def authenticate(self):
-        credentials = self.get_account_settings()
         try:
-            self.api = twitter.Api(**credentials, sleep_on_rate_limit=True)
-            self.authenticated_user = UserWrapper(self.api.VerifyCredentials())
+            self._create_api()
+            twitter_user = self._call_api('account/verify_credentials', self.api.VerifyCredentials)
+            self.authenticated_user = UserWrapper(twitter_user, avatar_cache=self.avatar_cache)
+            self._save_cached_account(twitter_user)
             #print(self.api.rate_limit.resources.get('blocks'))
         except TwitterError as e:
             print(e)
             pass
 
+    def get_cached_account(self):
+        """The account as it was on the last successful authentication or None, doesn't talk to twitter"""
+        with self._db_lock:
+            data = result_or_none(
+                self._db_connection.execute("select value from user_data where key='cached_account';").fetchone())
+        if data is None:
+            return None
+        return UserWrapper(twitter.User.NewFromJsonDict(json.loads(data)), avatar_cache=self.avatar_cache)
+
+    def _save_cached_account(self, twitter_user):
+        with self._db_lock:
+            self._db_connection.execute(
+                "insert into user_data (key, value) values ('cached_account', ?) "
+                "on conflict(key) do update set value=excluded.value;", [twitter_user.AsJsonString()])
+            self._db_connection.commit()
+
     def get_block_count(self):
-        return result_or_none(self._cursor.execute("select count(distinct user_id) from blocked_users;").fetchone())
+        return result_or_none(self._cursor.execute(
+            "select block_count from block_stats where scope = 'account' and id = 0;").fetchone()) or 0
+
+    def get_parent_block_count(self, parent_id):
+        """How many followers of parent_id are blocked"""
+        return result_or_none(self._cursor.execute(
+            "select block_count from block_stats where scope = 'parent' and id = ?;", [parent_id]).fetchone()) or 0
 
     def get_sync_date(self):
-        return result_or_none(self._cursor.execute("select value from user_data where key sync_date;").fetchone())
+        return result_or_none(self._cursor.execute("select value from user_data where key='sync_date';").fetchone())
 
-    def save_sync_date(self):
+    def save_sync_date(self, date=None):
         self._cursor.execute(
-            "insert into user_data (key, value) values (sync_date, ?) on conflict(key) do update set value=excluded.value;",
-            (datetime.utcnow(),))
+            "insert into user_data (key, value) values ('sync_date', ?) on conflict(key) do update set value=excluded.value;",
+            (date or datetime.utcnow(),))
         self._db_connection.commit()
 
+    def sync_blocklist(self, full=False) -> Generator[int, None, None]:
+        """Fetches the ids of all accounts blocked on Twitter, yields how many were synced so far.
+
+        Twitter returns the most recent blocks first, so after the first sync it stops at the first page that
+        has nothing new. A full sync reads everything and also forgets blocks that were removed on Twitter.
+        """
+        date = datetime.utcnow()
+        incremental = not full and self.get_sync_date() is not None
+        synced = 0
+        next_cursor = -1
+        previous_cursor = None
+        while next_cursor != 0 and next_cursor != previous_cursor:
+            next_cursor, previous_cursor, ids = self._call_api(
+                'blocks/ids', self.api.GetBlocksIDsPaged, cursor=next_cursor)
+            known = self._cursor.execute("select count(*) from synced_blocks;").fetchone()[0]
+            self._cursor.executemany(
+                "insert into synced_blocks (user_id, sync_date) values (?, ?) "
+                "on conflict(user_id) do update set sync_date=excluded.sync_date;",
+                ((user_id, date) for user_id in ids))
+            new = self._cursor.execute("select count(*) from synced_blocks;").fetchone()[0] - known
+            self._db_connection.commit()
+            synced += len(ids)
+            yield synced
+            if incremental and new == 0:
+                break
+        else:
+            if not incremental:
+                self._cursor.execute("delete from synced_blocks where sync_date < ?;", (date,))
+        self.save_sync_date(date)
+
+    def get_synced_block_count(self):
+        return result_or_none(self._cursor.execute("select count(*) from synced_blocks;").fetchone())
+
     def get_account_settings(self):
-        consumer_key = result_or_none(self._cursor.execute("select value from user_data where key='consumer_key';").fetchone())
-        consumer_secret = result_or_none(self._cursor.execute("select value from user_data where key='consumer_secret';").fetchone())
-        access_token_key = result_or_none(self._cursor.execute("select value from user_data where key='access_token_key';").fetchone())
-        access_token_secret = result_or_none(self._cursor.execute("select value from user_data where key='access_token_secret';").fetchone())
+        # authenticate() runs in a thread of its own in the GUI, so this doesn't use the shared cursor
+        with self._db_lock:
+            settings = dict(self._db_connection.execute(
+                "select key, value from user_data where key in "
+                "('consumer_key', 'consumer_secret', 'access_token_key', 'access_token_secret');").fetchall())
 
         return {
-            'consumer_key': consumer_key,
-            'consumer_secret': consumer_secret,
-            'access_token_key': access_token_key,
-            'access_token_secret': access_token_secret
+            'consumer_key': settings.get('consumer_key'),
+            'consumer_secret': settings.get('consumer_secret'),
+            'access_token_key': settings.get('access_token_key'),
+            'access_token_secret': settings.get('access_token_secret')
         }
 
     def save_account_settings(self, consumer_key, consumer_secret, access_token_key, access_token_secret):
@@ -115,89 +670,587 @@ class Blocker:
             "on conflict(key) do update set value=excluded.value;", values)
         self._db_connection.commit()
 
-    def _block_users(self, parent_id, user_ids: list, reason: str) -> Generator[int, None, None]:
+    def _block_users(self, parent_id, user_ids: array, reason: str, date, already_blocked=0,
+                     filtered=0) -> Generator[int, None, None]:
         """Blocks users by their ID"""
-        successful_blocks = 0
-        # it can take some time to create block if they are many so they could get different time stamps
-        # as the program runs but I think its better to have the same timestamp for each batch
-        date = datetime.utcnow()
-        user_ids.insert(0, parent_id)
-        for id in user_ids:
-            if self._block_user(id, parent_id, reason, date):
-                successful_blocks += 1
-            yield successful_blocks
+        successful_blocks = already_blocked
+        self.metrics.begin_run()
+        # the target, its followers that still need a block, the ones that were blocked already
+        # and the ones the filter rules spared
+        self.metrics.expect(len(user_ids) + 1 + already_blocked + filtered)
+        self.metrics.count_blocks('skipped', already_blocked + filtered)
+        # the target itself is stored without parent. The items are only created while blocking so the ids
+        # stay in their compact array until then
+        items = chain([(parent_id, [(None, reason)], date)], ((id, [(parent_id, reason)], date) for id in user_ids))
+        try:
+            for success in self._block_concurrently(items):
+                if success:
+                    successful_blocks += 1
+                yield successful_blocks
+        finally:
+            self.flush()
+            self.metrics.end_run()
 
-    def get_follower_ids(self, user_id) -> Generator[list[int], None, None]:
-        next_cursor = -1
+    def _filter_already_blocked(self, parent_id, user_ids, reason, date):
+        """Links the already blocked users in user_ids to parent_id and returns (count, ids still to block).
+
+        This is done in a handful of queries for the whole batch instead of one select per user, so the
+        blocking loop only ever sees ids that really need a CreateBlock call. Nothing is committed, and users
+        of other targets that are blocked but still sitting in the buffer are only found if it was flushed before.
+        """
+        self._cursor.execute("delete from block_candidates;")
+        self._cursor.executemany(
+            "insert into block_candidates (user_id) values (?);", ((user_id,) for user_id in user_ids))
+        # "where true" is needed so sqlite doesn't mistake the on conflict for a join constraint
+        self._cursor.execute(
+            """
+            insert into blocked_users (
+                user_id, 
+                user_name, 
+                parent_id, 
+                reason, 
+                block_date
+            ) 
+            select c.user_id, b.user_name, ?, ?, ? 
+            from block_candidates c 
+            join known_blocks b on b.user_id = c.user_id
+            where true
+            on conflict(user_id, parent_id) do 
+                update set user_name=excluded.user_name""",
+            (parent_id, reason, date))
+        already_blocked = self._cursor.execute(
+            "select count(distinct c.user_id) from block_candidates c join blocked_users b "
+            "on b.user_id = c.user_id and b.parent_id = ?;", [parent_id]).fetchone()[0]
+        remaining = array('q', (r[0] for r in self._cursor.execute(
+            "select user_id from block_candidates "
+            "where user_id not in (select user_id from known_blocks) "
+            "group by user_id order by min(position);").fetchall()))
+        self._cursor.execute("delete from block_candidates;")
+        return already_blocked, remaining
+
+    def _split_waiting(self, user_ids, parent_ids):
+        """Returns (waiting, others) of user_ids, waiting are in current_block_run for one of parent_ids already"""
+        self._cursor.execute("delete from block_candidates;")
+        self._cursor.executemany(
+            "insert into block_candidates (user_id) values (?);", ((user_id,) for user_id in user_ids))
+        marks = ", ".join("?" * len(parent_ids))
+        split = []
+        for condition in ("exists", "not exists"):
+            split.append(array('q', (r[0] for r in self._cursor.execute(
+                f"select c.user_id from block_candidates c where {condition} ("
+                f"select 1 from current_block_run r where r.user_id = c.user_id and r.parent_id in ({marks})"
+                f") order by c.position;", parent_ids).fetchall())))
+        self._cursor.execute("delete from block_candidates;")
+        return split[0], split[1]
+
+    def hydrate_users(self, user_ids, date=None):
+        """Looks up the users in user_ids that are not in user_metadata or outdated, 100 per request.
+
+        Users that are blocked already never get to the filter rules, so they aren't looked up. Every batch is
+        committed on its own, no transaction stays open while a lookup waits for the rate limit.
+        """
+        date = date or datetime.utcnow()
+        self._cursor.execute("delete from block_candidates;")
+        self._cursor.executemany(
+            "insert into block_candidates (user_id) values (?);", ((user_id,) for user_id in user_ids))
+        missing = array('q', (r[0] for r in self._cursor.execute(
+            "select c.user_id from block_candidates c left join user_metadata m on m.user_id = c.user_id "
+            "where (m.user_id is null or m.lookup_date < ?) "
+            "and c.user_id not in (select user_id from known_blocks) group by c.user_id;",
+            [date - USER_METADATA_MAX_AGE]).fetchall()))
+        self._cursor.execute("delete from block_candidates;")
+        self._db_connection.commit()
+        for i in range(0, len(missing), LOOKUP_BATCH_SIZE):
+            batch = missing[i:i + LOOKUP_BATCH_SIZE]
+            try:
+                users = self._call_api('users/lookup', self.api.UsersLookup, user_id=list(batch),
+                                       include_entities=False, return_json=True)
+            except TwitterError as e:
+                if twitter_error_code(e) != NO_USER_MATCHES_CODE:
+                    # these users are blocked like without rules, better than stopping the run
+                    print(e)
+                    continue
+                users = []
+            self.metrics.increment('users_looked_up', len(batch))
+            self._save_user_metadata(batch, users, date)
+            self._db_connection.commit()
+
+    def _save_user_metadata(self, user_ids, users, date):
+        found = {user['id'] for user in users}
+        rows = [[user['id'], user.get('screen_name'), user.get('followers_count', 0), int(bool(user.get('verified'))),
+                 int(bool(user.get('following'))), user.get('description'), 1, date] for user in users]
+        # users/lookup leaves out the ones that are deleted or suspended
+        rows.extend([user_id, None, None, 0, 0, None, 0, date] for user_id in user_ids if user_id not in found)
+        self._cursor.executemany(
+            "insert into user_metadata (user_id, screen_name, followers_count, verified, following, description, "
+            "found, lookup_date) values (?, ?, ?, ?, ?, ?, ?, ?) on conflict(user_id) do update set "
+            "screen_name=excluded.screen_name, followers_count=excluded.followers_count, "
+            "verified=excluded.verified, following=excluded.following, description=excluded.description, "
+            "found=excluded.found, lookup_date=excluded.lookup_date;", rows)
+
+    def _apply_filter_rules(self, user_ids, hydrate=True):
+        """Returns (count, ids to block) of user_ids without the ones the filter rules spare.
+
+        The users are looked up first if needed, unless hydrate is False because the caller did that already.
+        Then the rules are checked for the whole batch in one query.
+        """
+        if not self.filter_rules or not user_ids:
+            return 0, user_ids
+        if hydrate:
+            self.hydrate_users(user_ids)
+        where, parameters = self.filter_rules.where('m')
+        self._cursor.executemany(
+            "insert into block_candidates (user_id) values (?);", ((user_id,) for user_id in user_ids))
+        # users that couldn't be looked up have no metadata, they are blocked
+        remaining = array('q', (r[0] for r in self._cursor.execute(
+            f"select c.user_id from block_candidates c left join user_metadata m on m.user_id = c.user_id "
+            f"where m.user_id is null or ({where}) group by c.user_id order by min(c.position);", parameters)))
+        self._cursor.execute("delete from block_candidates;")
+        filtered = len(user_ids) - len(remaining)
+        self.metrics.increment('users_filtered', filtered)
+        return filtered, remaining
+
+    def get_follower_ids(self, user_id, cursor=-1) -> Generator[list[int], None, None]:
+        for _, _, data in self._get_follower_pages(user_id, cursor):
+            yield data
+
+    def _get_follower_pages(self, user_id, cursor=-1):
+        """Yields (cursor, next_cursor, ids) of every page starting at cursor, 0 means there is nothing left"""
+        next_cursor = cursor
         previous_cursor = None
         while next_cursor != 0 and next_cursor != previous_cursor:
-            next_cursor, previous_cursor, data = self.api.GetFollowerIDsPaged(user_id=user_id, cursor=next_cursor)
-            yield data
+            cursor = next_cursor
+            next_cursor, previous_cursor, data = self._call_api(
+                'followers/ids', self.api.GetFollowerIDsPaged, user_id=user_id, cursor=cursor)
+            self.metrics.increment('follower_pages_fetched')
+            self.metrics.increment('follower_ids_fetched', len(data))
+            yield cursor, next_cursor, data
+
+    def _create_block(self, user_id):
+        """Runs in the block worker threads, so it must not touch the database.
 
-    def _block_user(self, user_id, parent_id, reason, date):
-        error = False
+        The scheduler paces the workers, every one of them takes a request of the blocks/create window before
+        it sends one, so together they never use more than twitter says is remaining.
+        """
         try:
-            blocked_user = self.get_blocked_user(user_id)
-            if not blocked_user:
-                tu = self.api.CreateBlock(user_id=user_id, include_entities=False, skip_status=True)
-                blocked_user = {'user_id': tu.id, 'user_name': tu.screen_name}
+            tu = self._call_api('blocks/create', self.api.CreateBlock,
+                                user_id=user_id, include_entities=False, skip_status=True)
+            return {'user_id': tu.id, 'user_name': tu.screen_name}
+        except TwitterError as e:
+            print(e)
+            return None
 
+    def _destroy_block(self, user_id):
+        """Runs in the block worker threads, so it must not touch the database"""
+        try:
+            self._call_api('blocks/destroy', self.api.DestroyBlock,
+                           user_id=user_id, include_entities=False, skip_status=True)
+            return True
         except TwitterError as e:
+            if twitter_error_code(e) in (USER_NOT_FOUND_CODE, PAGE_NOT_FOUND_CODE):
+                # the user is gone and the block with it
+                return True
             print(e)
-            error = True
-        else:
-            self._cursor.execute(
-                """
-                insert into blocked_users (
-                    user_id, 
-                    user_name, 
-                    parent_id, 
-                    reason, 
-                    block_date
-                ) 
-                values (?, ?, ?, ?, ?) 
-                on conflict(user_id, parent_id) do 
-                    update set user_name=excluded.user_name""",
-                (blocked_user['user_id'], blocked_user['user_name'], parent_id if blocked_user['user_id'] != parent_id else None, reason,
-                 date))
-
-        if parent_id == user_id:
-            # TODO check if this can actually happen the way the table is filled
-            self._cursor.execute(
-                """
-                delete from current_block_run where user_id = ? and parent_id is null
-                """, [user_id])
-        else:
-            self._cursor.execute(
-                """
-                delete from current_block_run where user_id = ? and parent_id = ?
-                """, [user_id, parent_id])
+            return False
 
-        # do some commits so the collected data is not lost in case the thing breaks
-        self._db_connection.commit()
-        return not error
+    def _call_api(self, endpoint, method, *args, **kwargs):
+        """Calls a twitter.Api method once the rate limit of endpoint allows it and records its latency.
+
+        When twitter answers that the limit is exceeded anyway, it waits for the reset and tries again.
+        """
+        while True:
+            waited = self.scheduler.acquire(endpoint)
+            if waited >= 0.01:
+                self.metrics.increment('rate_limit_sleep_seconds', waited, endpoint=endpoint)
+            try:
+                with self.metrics.timer('api_request_seconds', endpoint=endpoint):
+                    return method(*args, **kwargs)
+            except TwitterError as e:
+                if twitter_error_code(e) != RateLimitScheduler.RATE_LIMIT_EXCEEDED_CODE:
+                    raise
+                limit = self._get_endpoint_rate_limit(endpoint)
+                self.scheduler.exhausted(endpoint, limit.reset if limit else None)
+            finally:
+                limit = self._get_endpoint_rate_limit(endpoint)
+                if limit:
+                    self.scheduler.update(endpoint, limit.limit, limit.remaining, limit.reset)
+
+    def _get_endpoint_rate_limit(self, endpoint):
+        """The rate limit python-twitter read from the headers of the last response of endpoint or None"""
+        rate_limit = getattr(self.api, 'rate_limit', None)
+        if not isinstance(rate_limit, RateLimit):
+            return None
+        # url_to_resource knows how python-twitter names the endpoints, e.g. /users/show/:id
+        url = f"{self.api.base_url}/{endpoint}.json"
+        resource = RateLimit.url_to_resource(url)
+        if resource not in rate_limit.resources.get(resource.split('/')[1], {}):
+            # get_limit would make up a limit of 15 for endpoints it hasn't seen a response of yet
+            return None
+        return rate_limit.get_limit(url)
+
+    def _block_concurrently(self, items, idle=None) -> Generator[bool, None, None]:
+        """Blocks (user_id, [(parent_id, reason), ...], date) items with up to block_workers requests in flight.
+
+        Every user is blocked once and recorded for each of its parents, parent_id is None for a target itself.
+        Followers must not be blocked already, only targets are looked up in known_blocks here.
+        The results are recorded and yielded in the same order as the items. items may yield None to say that
+        the next item isn't there yet, then everything still running is finished first instead of keeping it
+        waiting for an item that might take a while, and None is yielded after it.
+        idle is called over and over while the oldest block is still running, e.g. when /blocks/create is rate
+        limited, until it returns False because it has nothing to do anymore.
+        """
+        def start(executor, item):
+            # followers were checked against known_blocks in bulk before they got here, targets weren't
+            if any(parent_id is None for parent_id, _ in item[1]):
+                blocked_user = self.get_blocked_user(item[0])
+                if blocked_user:
+                    future = Future()
+                    future.set_result(blocked_user)
+                    return future, True
+            return executor.submit(self._create_block, item[0]), False
+
+        def finish(item, blocked_user, known):
+            user_id, parents, date = item
+            self.metrics.count_blocks('skipped' if known else 'succeeded' if blocked_user else 'failed')
+            for parent_id, reason in parents:
+                self._buffer_block_result(
+                    blocked_user['user_id'] if blocked_user else user_id,
+                    blocked_user['user_name'] if blocked_user else None,
+                    parent_id, reason, date, blocked_user is not None)
+            return blocked_user is not None
+
+        yield from self._run_concurrently(items, start, finish, idle)
+
+    def _run_concurrently(self, items, start, finish, idle=None):
+        """Keeps up to block_workers requests in flight and yields what finish returns for each, in order.
+
+        start(executor, item) returns (future, known), finish(item, result, known) records the result.
+        A None item finishes everything in flight and is yielded as None, so the caller gets control back even
+        while nothing is blocked.
+        """
+        in_flight = deque()
+
+        def finish_oldest():
+            future = in_flight[0][1]
+            # the results buffered so far are flushed on time even while a block waits for the rate limit
+            while not future.done():
+                busy = idle is not None and idle()
+                wait([future], timeout=0.05 if busy else 0.5)
+                self._flush_if_due()
+            item, future, known = in_flight.popleft()
+            return finish(item, future.result(), known)
+
+        with ThreadPoolExecutor(max_workers=self.block_workers, thread_name_prefix="block-worker") as executor:
+            for item in items:
+                if item is None:
+                    while in_flight:
+                        yield finish_oldest()
+                    yield None
+                    continue
+
+                in_flight.append((item, *start(executor, item)))
+
+                while len(in_flight) >= self.block_workers or (in_flight and in_flight[0][1].done()):
+                    yield finish_oldest()
+
+            while in_flight:
+                yield finish_oldest()
 
     def block_users(self, parent_id, user_ids, reason):
         """Will block all users in user_ids."""
+        # it can take some time to create block if they are many so they could get different time stamps
+        # as the program runs but I think its better to have the same timestamp for each batch
+        date = datetime.utcnow()
+        # users of other targets that are blocked but still sitting in the buffer must be found too
+        self.flush()
+        already_blocked, user_ids = self._filter_already_blocked(parent_id, user_ids, reason, date)
+        filtered, user_ids = self._apply_filter_rules(user_ids)
         self._save_to_current_block_run(parent_id, user_ids, reason)
 
-        return self._block_users(parent_id, user_ids, reason)
+        return self._block_users(parent_id, user_ids, reason, date, already_blocked, filtered)
 
     def block_followers(self, user_id, reason):
         """Will fetch the followers of user_id directly from twitter and then block them"""
         try:
-            follower_ids = self.api.GetFollowerIDs(user_id=user_id)
-            self._save_to_current_block_run(user_id, follower_ids, reason)
+            follower_ids = array('q')
+            for page in self.get_follower_ids(user_id):
+                follower_ids.extend(page)
         except TwitterError as e:
             print(e)
             return None
-        return self._block_users(user_id, follower_ids, reason)
+        return self.block_users(user_id, follower_ids, reason)
+
+    def get_follower_snapshot(self, user_id):
+        """Returns (snapshot_date, sorted array of follower ids) of the last finished run of user_id or None"""
+        r = self._cursor.execute(
+            "select snapshot_date, ids from follower_snapshots where parent_id = ?;", [user_id]).fetchone()
+        if r is None:
+            return None
+        return r[0], decode_ids(r[1])
+
+    def save_follower_snapshot(self, user_id, date=None):
+        """Saves the followers that are blocked or linked to user_id, the next fetch skips only those.
+
+        Followers whose block failed or that the filter rules spared aren't in it, so they get another chance.
+        """
+        follower_ids = np.fromiter((r[0] for r in self._db_connection.execute(
+            "select user_id from blocked_users where parent_id = ? order by user_id;", [user_id])), dtype=np.int64)
+        self._cursor.execute(
+            "insert into follower_snapshots (parent_id, snapshot_date, follower_count, ids) values (?, ?, ?, ?) "
+            "on conflict(parent_id) do update set snapshot_date=excluded.snapshot_date, "
+            "follower_count=excluded.follower_count, ids=excluded.ids;",
+            (user_id, date or datetime.utcnow(), len(follower_ids), encode_ids(follower_ids)))
+        self._db_connection.commit()
+
+    def _save_finished_snapshots(self, parent_ids, date=None):
+        """Saves the snapshots of the targets in parent_ids that have no followers left in current_block_run"""
+        for parent_id in parent_ids:
+            if self._cursor.execute(
+                    "select 1 from current_block_run where parent_id = ? limit 1;", [parent_id]).fetchone() is None:
+                self.save_follower_snapshot(parent_id, date)
+
+    def block_followers_streaming(self, user_id, reason, queue_size=5, new_only=True) -> Generator[int, None, None]:
+        """Fetches the followers of user_id in a background thread and blocks them while the pages are still arriving.
+
+        This way the rate limit windows of /followers/ids and /blocks/create overlap instead of running one
+        after the other. At most queue_size pages are kept in memory before they are saved to current_block_run.
+        With new_only the followers that were blocked by the last run of user_id are skipped.
+        """
+        yield from self._block_targets_streaming([(user_id, reason)], queue_size, new_only)
+
+    def _block_targets_streaming(self, targets, queue_size=5, new_only=True) -> Generator[int, None, None]:
+        """Like block_followers_streaming for several (user_id, reason) targets at once.
+
+        The targets are fetched one after the other by the same background thread, the next one as soon as the
+        previous one is done, no matter how far blocking got. Whenever blocking waits, for the rate limit or
+        just for twitter, the pages that arrived in the meantime are saved, so fetching never has to wait for it.
+        Every page is saved together with the cursor of the next one, queued targets that were interrupted
+        continue from there.
+        """
+        date = datetime.utcnow()
+        reasons = dict(targets)
+        cursors = {user_id: self._get_target_cursor(user_id) for user_id, _ in targets}
+        pages = queue.Queue(maxsize=queue_size)
+        stop = threading.Event()
 
-    def _save_to_current_block_run(self, parent_id, user_ids, reason):
-        # saving accounts to block so they don't have to be requested again in case something happens
-        batch = [[user_id, parent_id, reason] for user_id in user_ids]
-        batch.append([parent_id, None, reason])
-        self._cursor.execute("delete from current_block_run;")
+        def put(item):
+            # don't hang forever on a full queue when nobody is consuming anymore
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def fetch():
+            for user_id, _ in targets:
+                try:
+                    for _, next_cursor, page in self._get_follower_pages(user_id, cursors[user_id]):
+                        if not put((user_id, page, next_cursor)):
+                            return
+                except TwitterError as e:
+                    print(e)
+                    if not put((user_id, _FETCH_FAILED, None)):
+                        return
+                else:
+                    if not put((user_id, _FETCH_DONE, None)):
+                        return
+
+        # the rows of the targets themselves are only processed here, a target that is blocked already, e.g. by
+        # continue_blocking resuming an interrupted run, is only linked and not counted a second time
+        unblocked_targets = []
+        for user_id, reason in targets:
+            blocked_user = self.get_blocked_user(user_id)
+            if blocked_user is None:
+                self._save_to_current_block_run(user_id, [], reason)
+                unblocked_targets.append((user_id, reason))
+            else:
+                self._buffer_block_result(user_id, blocked_user['user_name'], None, reason, date, True)
+        fetcher = threading.Thread(target=fetch, name="follower-fetcher", daemon=True)
+        fetcher.start()
+
+        successful_blocks = 0
+        fetching = len(targets)
+        # targets whose followers are all in current_block_run, their snapshots are saved once they are blocked
+        fetched = []
+        # per target that is being fetched: the followers of its last snapshot
+        previous_ids = {}
+        # [parent_id, ids, position] segments of followers waiting to be blocked, everything before position is done
+        to_block = deque()
+
+        def take_page(user_id, page, next_cursor):
+            nonlocal successful_blocks, fetching
+            reason = reasons[user_id]
+            if page is _FETCH_DONE or page is _FETCH_FAILED:
+                if page is _FETCH_DONE:
+                    self._mark_target_fetched(user_id)
+                    fetched.append(user_id)
+                # a failed target keeps its cursor for the next run
+                previous_ids.pop(user_id, None)
+                fetching -= 1
+                return
+
+            if user_id not in previous_ids:
+                snapshot = self.get_follower_snapshot(user_id) if new_only else None
+                previous_ids[user_id] = snapshot[1] if snapshot else None
+            self.metrics.expect(len(page))
+            previous = previous_ids[user_id]
+            if previous is not None and len(previous):
+                page_ids = np.array(page, dtype=np.int64)
+                new_ids = array('q', page_ids[~isin_sorted(page_ids, previous)].tobytes())
+                # those were taken care of by an earlier run
+                successful_blocks += len(page) - len(new_ids)
+                self.metrics.count_blocks('skipped', len(page) - len(new_ids))
+                page = new_ids
+            # the buffered blocks of other targets have to be found, and the lookups for the filter rules can wait
+            # for the rate limit, both commit before the page's transaction starts
+            self.flush()
+            if self.filter_rules:
+                self.hydrate_users(page)
+            # one transaction, so a page is either completely saved with the cursor after it or fetched again.
+            # Whatever commits after an interruption, e.g. the flush in finally, finds it rolled back
+            try:
+                already_blocked, remaining = self._filter_already_blocked(user_id, page, reason, date)
+                filtered, remaining = self._apply_filter_rules(remaining, hydrate=False)
+                # followers of another target that are still waiting for their block are only blocked once,
+                # their rows of this target are linked when the run is over
+                waiting, remaining = self._split_waiting(remaining, list(reasons))
+                self._save_target_cursor(user_id, next_cursor)
+                self._add_to_current_block_run(user_id, chain(remaining, waiting), reason, commit=False)
+                self._db_connection.commit()
+            except BaseException:
+                self._db_connection.rollback()
+                raise
+            self.metrics.count_blocks('skipped', filtered)
+            successful_blocks += already_blocked + len(waiting)
+            self.metrics.count_blocks('skipped', already_blocked + len(waiting))
+            if remaining:
+                to_block.append([user_id, remaining, 0])
+
+        def take_pages(block=False):
+            """Saves the pages that arrived, with block waits for one if there are none. False once all are fetched"""
+            while fetching:
+                try:
+                    item = pages.get(timeout=0.5) if block else pages.get_nowait()
+                except queue.Empty:
+                    if not block:
+                        break
+                    self._flush_if_due()
+                    continue
+                take_page(*item)
+                block = False
+            return fetching > 0
+
+        def ids_to_block():
+            # the targets themselves first, they are stored without parent
+            for user_id, reason in unblocked_targets:
+                self.metrics.expect(1)
+                yield user_id, [(None, reason)], date
+            while take_pages() or to_block:
+                if not to_block:
+                    # let the blocks that are still running finish while we wait for the next page
+                    yield None
+                    take_pages(block=not to_block)
+                    continue
+                segment = to_block[0]
+                parent_id, ids, position = segment
+                segment[2] += 1
+                if segment[2] == len(ids):
+                    to_block.popleft()
+                yield ids[position], [(parent_id, reasons[parent_id])], date
+
+        self.metrics.begin_run()
+        try:
+            reported = None
+            # None while the next page is awaited, the followers that were skipped meanwhile count too.
+            # Otherwise a run that skips everything, e.g. a target without new followers, would report nothing
+            for success in self._block_concurrently(ids_to_block(), idle=take_pages):
+                if success:
+                    successful_blocks += 1
+                yield successful_blocks
+                reported = successful_blocks
+            if successful_blocks != reported:
+                yield successful_blocks
+        finally:
+            stop.set()
+            self.flush()
+            self._filter_current_block_run(date)
+            self._save_finished_snapshots(fetched, date)
+            self.metrics.end_run()
+
+    def _save_to_current_block_run(self, parent_id, user_ids, reason, commit=True):
+        # saving accounts to block so they don't have to be requested again in case something happens.
+        # Runs of other targets stay in there, users they share are only blocked once.
+        self._insert_parentless('current_block_run', ('reason',), [(parent_id, reason)])
+        self._add_to_current_block_run(parent_id, user_ids, reason, commit)
+
+    def queue_target(self, user_id, reason):
+        """Adds a target to the block queue, it and its followers are fetched and blocked by block_queue"""
+        self._cursor.execute(
+            "insert into block_targets (parent_id, reason) values (?, ?) "
+            "on conflict(parent_id) do update set reason=excluded.reason;", [user_id, reason])
+        self._db_connection.commit()
+
+    def get_queued_targets(self, fetched=None):
+        """Returns (user_id, reason, fetched) of the queued targets in the order they were added"""
+        if fetched is None:
+            rows = self._cursor.execute("select parent_id, reason, fetched from block_targets order by position;")
+        else:
+            rows = self._cursor.execute(
+                "select parent_id, reason, fetched from block_targets where fetched = ? order by position;",
+                [int(fetched)])
+        return [(r[0], r[1], bool(r[2])) for r in rows.fetchall()]
+
+    def _get_target_cursor(self, user_id):
+        """Cursor to continue fetching the followers of a target at, -1 if it is fetched from the start"""
+        cursor = result_or_none(self._cursor.execute(
+            "select next_cursor from block_targets where parent_id = ?;", [user_id]).fetchone())
+        return cursor if cursor is not None else -1
+
+    def _save_target_cursor(self, user_id, next_cursor):
+        # not committed, the caller does that together with the followers of the page
+        self._cursor.execute("update block_targets set next_cursor = ? where parent_id = ?;", [next_cursor, user_id])
+
+    def _mark_target_fetched(self, user_id):
+        self._cursor.execute(
+            "update block_targets set fetched = 1, next_cursor = -1 where parent_id = ?;", [user_id])
+        self._db_connection.commit()
+
+    def _remove_finished_targets(self):
+        self._cursor.execute(
+            """
+            delete from block_targets where fetched = 1 
+                and parent_id not in (select parent_id from current_block_run where parent_id is not null) 
+                and parent_id not in (select user_id from current_block_run where parent_id is null)
+            """)
+        self._db_connection.commit()
+
+    def block_queue(self) -> Generator[int, None, None]:
+        """Blocks everything in the queue, first what is left in current_block_run then the unfetched targets.
+
+        Users that follow several targets are blocked once and recorded for every target. Everything is stored
+        as it goes, so this can be stopped and called again at any time.
+        """
+        successful_blocks = 0
+        self.metrics.begin_run()
+        try:
+            for successful_blocks in self.continue_blocking():
+                yield successful_blocks
+            offset = successful_blocks
+            targets = [(user_id, reason) for user_id, reason, _ in self.get_queued_targets(fetched=False)]
+            if targets:
+                for i in self._block_targets_streaming(targets):
+                    successful_blocks = offset + i
+                    yield successful_blocks
+        finally:
+            self.flush()
+            self._remove_finished_targets()
+            self.metrics.end_run()
+
+    def _add_to_current_block_run(self, parent_id, user_ids, reason, commit=True):
+        """Adds the users to the run of parent_id, with commit=False the caller commits them with its transaction"""
+        batch = ([user_id, parent_id, reason] for user_id in user_ids)
         self._cursor.executemany("""
                        insert into current_block_run (
                            user_id, 
@@ -206,62 +1259,318 @@ class Blocker:
                        ) 
                        values (?, ?, ?) on conflict(user_id, parent_id) do 
                            update set reason=excluded.reason;""", batch)
-        self._db_connection.commit()
+        if commit:
+            self._db_connection.commit()
 
     def get_last_run_info(self):
-        c = result_or_none(self._cursor.execute("select count(*) from current_block_run;").fetchone())
+        c = result_or_none(self._cursor.execute("select count(distinct user_id) from current_block_run;").fetchone())
+        c += result_or_none(self._cursor.execute("select count(*) from block_targets where fetched = 0;").fetchone())
         if c is not None and c > 0:
             r = result_or_none(self._cursor.execute("select reason from current_block_run limit 1;").fetchone())
         else:
             r = None
         return c, r
 
+    def get_last_run_target_ids(self):
+        """All targets of the last run, queued ones first"""
+        ids = [r[0] for r in self.get_queued_targets()]
+        self._cursor.execute(
+            "select parent_id from current_block_run where parent_id is not null "
+            "union select user_id from current_block_run where parent_id is null;")
+        # imported blocklists can put a lot of users without parent in there, no list lookups
+        queued = set(ids)
+        ids.extend(r[0] for r in self._cursor.fetchall() if r[0] not in queued)
+        return ids
+
     def get_last_run_target_id(self):
-        self._cursor.execute("select distinct(parent_id) from current_block_run")
-        res = self._cursor.fetchall()
-        if len(res) > 1:
-            raise Exception("There shouldn't be more than one distinct parent_id in current_block_run table")
-        return res[0][0]
+        return next(iter(self.get_last_run_target_ids()), None)
 
-    def continue_blocking(self):
+    def _filter_current_block_run(self, date):
+        """Links users of the current run that are blocked already and removes them from the run"""
         self._cursor.execute(
             """
-            select user_id, parent_id, reason from current_block_run;
+            insert into blocked_users (
+                user_id, 
+                user_name, 
+                parent_id, 
+                reason, 
+                block_date
+            ) 
+            select r.user_id, b.user_name, r.parent_id, r.reason, ? 
+            from current_block_run r 
+            join known_blocks b on b.user_id = r.user_id
+            where r.parent_id is not null
+            on conflict(user_id, parent_id) do 
+                update set user_name=excluded.user_name""",
+            (date,))
+        self._cursor.execute(
+            """
+            delete from current_block_run 
+            where parent_id is not null and user_id in (select user_id from known_blocks)
             """)
-        result = self._cursor.fetchall()
+        self._db_connection.commit()
+
+    def _current_block_run_rows(self, chunk_size=10000):
+        """Rows of current_block_run sorted by user, read in chunks of chunk_size users instead of all at once"""
+        last_user_id = -1
+        while True:
+            rows = self._db_connection.execute(
+                """
+                select user_id, parent_id, reason from current_block_run 
+                where user_id > ? and user_id <= (
+                    select max(user_id) from (
+                        select user_id from current_block_run where user_id > ? order by user_id limit ?
+                    )
+                ) 
+                order by user_id;
+                """, (last_user_id, last_user_id, chunk_size)).fetchall()
+            if not rows:
+                return
+            yield from rows
+            last_user_id = rows[-1][0]
+
+    def continue_blocking(self):
         date = datetime.utcnow()
+        self._filter_current_block_run(date)
+        if self._cursor.execute("select 1 from current_block_run limit 1;").fetchone() is None:
+            return
+
+        # what the targets of the run got done before, their blocked followers and the targets themselves
+        successful_blocks = self._cursor.execute(
+            """
+            select coalesce(sum(s.block_count), 0) + coalesce(sum(
+                exists (select 1 from blocked_users b where b.user_id = p.parent_id) 
+                or exists (select 1 from synced_blocks y where y.user_id = p.parent_id)
+            ), 0) 
+            from (select distinct parent_id from current_block_run where parent_id is not null) p 
+            left join block_stats s on s.scope = 'parent' and s.id = p.parent_id
+            """).fetchone()[0]
+        # targets that are still being fetched get their snapshot when the fetch is done
+        parent_ids = [r[0] for r in self._cursor.execute(
+            "select distinct parent_id from current_block_run where parent_id is not null "
+            "and parent_id not in (select parent_id from block_targets where fetched = 0);").fetchall()]
+
+        # sorted by user so users that follow several targets can be grouped and blocked only once
+        items = ((user_id, [(row[1], row[2]) for row in rows], date)
+                 for user_id, rows in groupby(self._current_block_run_rows(), key=lambda row: row[0]))
+        self.metrics.begin_run()
+        self.metrics.expect(
+            self._cursor.execute("select count(distinct user_id) from current_block_run;").fetchone()[0])
+        try:
+            for success in self._block_concurrently(items):
+                if success:
+                    successful_blocks += 1
+                yield successful_blocks
+        finally:
+            self.flush()
+            self._save_finished_snapshots(parent_ids, date)
+            self.metrics.end_run()
+
+    def queue_unblock(self, parent_id=None, reason=None, since=None, until=None):
+        """Queues the blocks that match all of the given conditions for continue_unblocking.
+
+        parent_id takes the target itself and its followers, since and until are datetimes and select
+        since <= block_date < until. Returns how many users are queued for unblocking now.
+        """
+        conditions = []
+        parameters = []
+        if parent_id is not None:
+            conditions.append("(b.parent_id = ? or (b.user_id = ? and b.parent_id is null))")
+            parameters.extend([parent_id, parent_id])
+        if reason is not None:
+            conditions.append("b.reason = ?")
+            parameters.append(reason)
+        if since is not None:
+            conditions.append("b.block_date >= ?")
+            parameters.append(since)
+        if until is not None:
+            conditions.append("b.block_date < ?")
+            parameters.append(until)
+        if not conditions:
+            raise ValueError("At least one of parent_id, reason, since and until is needed")
+        self._cursor.execute(
+            f"""
+            insert into current_unblock_run (user_id, parent_id) 
+            select b.user_id, b.parent_id from blocked_users b 
+            where {" and ".join(conditions)} and not exists (
+                select 1 from current_unblock_run u where u.user_id = b.user_id and u.parent_id is b.parent_id
+            )""", parameters)
+        # otherwise the next runs of these targets would skip the unblocked followers
+        self._cursor.execute(
+            "delete from follower_snapshots where parent_id in (select parent_id from current_unblock_run);")
+        self._db_connection.commit()
+        return self.get_unblock_count()
+
+    def get_unblock_count(self):
+        """How many users are queued for unblocking"""
+        return self._cursor.execute("select count(distinct user_id) from current_unblock_run;").fetchone()[0]
+
+    def _current_unblock_run_ids(self, chunk_size=10000):
+        last_user_id = -1
+        while True:
+            ids = [r[0] for r in self._db_connection.execute(
+                "select distinct user_id from current_unblock_run where user_id > ? order by user_id limit ?;",
+                (last_user_id, chunk_size)).fetchall()]
+            if not ids:
+                return
+            yield from ids
+            last_user_id = ids[-1]
+
+    def continue_unblocking(self) -> Generator[int, None, None]:
+        """Unblocks the users queued by queue_unblock and removes their rows, yields the successful unblocks.
+
+        Users that are blocked because of another target too stay blocked, only their queued rows are removed.
+        Everything is stored as it goes, so this can be stopped and called again at any time.
+        """
+        self._cursor.execute(
+            """
+            delete from blocked_users where exists (
+                select 1 from current_unblock_run u 
+                where u.user_id = blocked_users.user_id and u.parent_id is blocked_users.parent_id
+            ) and exists (
+                select 1 from blocked_users o where o.user_id = blocked_users.user_id and not exists (
+                    select 1 from current_unblock_run u where u.user_id = o.user_id and u.parent_id is o.parent_id
+                )
+            )""")
+        # rows of users that stay blocked because of another target
+        self.metrics.increment('unblock_rows_dropped', self._cursor.rowcount)
+        # rows that are gone now, or were deleted by hand in the meantime
+        self._cursor.execute(
+            """
+            delete from current_unblock_run where not exists (
+                select 1 from blocked_users b 
+                where b.user_id = current_unblock_run.user_id and b.parent_id is current_unblock_run.parent_id
+            )""")
+        self._db_connection.commit()
+
+        def start(executor, user_id):
+            return executor.submit(self._destroy_block, user_id), False
 
-        id_ = result[0][1]
-        count = self._cursor.execute("select count(*) from blocked_users where parent_id = ? or user_id = ?;", [id_, id_]).fetchone()[0]
+        def finish(user_id, success, known):
+            self.metrics.increment('unblocks', outcome='succeeded' if success else 'failed')
+            self._buffer_unblock_result(user_id, success)
+            return success
+
+        successful_unblocks = 0
+        try:
+            for success in self._run_concurrently(self._current_unblock_run_ids(), start, finish):
+                if success:
+                    successful_unblocks += 1
+                yield successful_unblocks
+        finally:
+            self.flush()
 
-        successful_blocks = count
-        for row in result:
-            if self._block_user(row[0], row[1], row[2], date):
-                successful_blocks += 1
-            yield successful_blocks
+    def export_blocklist(self, f, binary=False, parent_id=None, reason=None):
+        """Writes the blocks to f and returns how many there were, see blocklist_io for the formats.
+
+        parent_id selects a target and its followers, reason the blocks with that reason. f is a binary file
+        for the binary format and a text file for CSV. The rows come straight from a cursor, in user id order.
+        """
+        conditions = []
+        parameters = []
+        if parent_id is not None:
+            conditions.append("(parent_id = ? or (user_id = ? and parent_id is null))")
+            parameters.extend([parent_id, parent_id])
+        if reason is not None:
+            conditions.append("reason = ?")
+            parameters.append(reason)
+        where = f"where {' and '.join(conditions)}" if conditions else ""
+        if binary:
+            count = self._cursor.execute(
+                f"select count(distinct user_id) from blocked_users {where};", parameters).fetchone()[0]
+            metadata = {
+                'count': count,
+                'parent_id': parent_id,
+                'reason': reason,
+                'account': self.authenticated_user.screen_name if self.authenticated_user else None,
+                'export_date': datetime.utcnow().isoformat(timespec='seconds'),
+            }
+            rows = self._db_connection.execute(
+                f"select distinct user_id from blocked_users {where} order by user_id;", parameters)
+            blocklist_io.write_binary(f, (r[0] for r in rows), metadata)
+            return count
+        count = 0
+
+        def rows():
+            nonlocal count
+            for row in self._db_connection.execute(
+                    f"select user_id, user_name, parent_id, reason, block_date from blocked_users {where} "
+                    f"order by user_id, parent_id;", parameters):
+                count += 1
+                yield row
+
+        blocklist_io.write_csv(f, rows())
+        return count
+
+    def import_blocklist(self, f, parent_id=None, reason=None, chunk_size=10000):
+        """Adds the users of an exported blocklist to current_block_run, continue_blocking blocks them then.
+
+        f is a binary file, CSV or the binary format is told apart by its first bytes. parent_id and reason
+        replace what the file says, without either the users are stored as blocked on their own like a target.
+        The rows are saved chunk_size at a time, the filter rules apply. Returns (saved, filtered) counts.
+        """
+        if blocklist_io.is_binary(f):
+            metadata, ids = blocklist_io.read_binary(f)
+            rows = ((user_id, metadata.get('parent_id'), metadata.get('reason')) for user_id in ids)
+        else:
+            rows = blocklist_io.read_csv(io.TextIOWrapper(f, encoding='utf-8', newline=''))
+        saved = 0
+        filtered = 0
+        chunk = []
+        for row in chain(rows, [None]):
+            if row is not None:
+                chunk.append((row[0], parent_id if parent_id is not None else row[1],
+                              reason if reason is not None else row[2] or "imported"))
+                if len(chunk) < chunk_size:
+                    continue
+            groups = {}
+            for user_id, row_parent_id, row_reason in chunk:
+                groups.setdefault((row_parent_id, row_reason), array('q')).append(user_id)
+            chunk = []
+            for (row_parent_id, row_reason), user_ids in groups.items():
+                count, user_ids = self._apply_filter_rules(user_ids)
+                filtered += count
+                saved += len(user_ids)
+                if row_parent_id is not None:
+                    self._add_to_current_block_run(row_parent_id, user_ids, row_reason)
+                    continue
+                self._insert_parentless('current_block_run', ('reason',), ((user_id, row_reason) for user_id in user_ids))
+                self._db_connection.commit()
+        return saved, filtered
 
     def get_user(self, screen_name=None, user_id=None):
-        """Retrieve a user via Twitter API"""
+        """Retrieve a user via Twitter API, recently looked up users come from the user cache"""
+        hit, user = self.user_cache.get(screen_name, user_id)
+        if hit:
+            if isinstance(user, UserSuspendedError):
+                raise user
+            return user
+
         try:
             if user_id:
-                user = self.api.GetUser(user_id=user_id)
+                user = self._call_api('users/show', self.api.GetUser, user_id=user_id)
             elif screen_name:
-                user = self.api.GetUser(screen_name=screen_name)
+                user = self._call_api('users/show', self.api.GetUser, screen_name=screen_name)
             else:
                 raise ValueError("Either screen_name or user_id must be given")
         except TwitterError as e:
             if UserSuspendedError.is_this_error(e):
-                raise UserSuspendedError(user_id, screen_name) from e
+                error = UserSuspendedError(user_id, screen_name)
+                self.user_cache.put(error, screen_name, user_id)
+                raise error from e
+            if twitter_error_code(e) == USER_NOT_FOUND_CODE:
+                self.user_cache.put(None, screen_name, user_id)
             print(e.message)
             return None
 
-        return UserWrapper(user)
+        user = UserWrapper(user, avatar_cache=self.avatar_cache)
+        self.user_cache.put(user)
+        return user
 
     def get_blocked_user(self, user_id):
-        """Get user from local block database"""
+        """Get user from local block database, blocks synced from twitter are found too but have no user_name"""
         r = self._cursor.execute(
-            "select user_id, parent_id, user_name, reason "
-            "from blocked_users where user_id = ?", [user_id]).fetchone()
+            "select user_id, user_name from known_blocks where user_id = ?;", [user_id]).fetchone()
         if r is not None:
-            return {'user_id': r[0], 'parent_id': r[1], 'user_name': r[2], 'reason': r[3]}
+            return {'user_id': r[0], 'user_name': r[1]}
 
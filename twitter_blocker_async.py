@@ -0,0 +1,248 @@
+from array import array
+from collections import deque
+from datetime import datetime
+from io import BytesIO
+from itertools import chain
+from typing import AsyncGenerator
+from urllib.parse import urlencode
+import asyncio
+import time
+
+from oauthlib.oauth1 import Client as OAuth1Client
+from PIL import Image
+from twitter import TwitterError, User
+import httpx
+
+from twitter_blocker import (Blocker, UserSuspendedError, UserWrapper, USER_NOT_FOUND_CODE, profile_pic_url,
+                             twitter_error_code)
+
+
+class AsyncBlocker:
+    """Blocking engine that talks to Twitter with coroutines over one pooled keep-alive connection pool.
+
+    It uses the database and account settings of a Blocker, so both can be used side by side. All requests,
+    including the avatar downloads, share the same few connections instead of every request or thread doing
+    its own TLS handshake.
+    """
+
+    base_url = "https://api.twitter.com/1.1"
+
+    def __init__(self, blocker: Blocker, concurrency=8, max_connections=4):
+        self.blocker = blocker
+        if blocker.base_url:
+            self.base_url = blocker.base_url
+        self.concurrency = concurrency
+        self.max_connections = max_connections
+        self._client = None
+        self._oauth = None
+
+    async def __aenter__(self):
+        credentials = self.blocker.get_account_settings()
+        self._oauth = OAuth1Client(
+            credentials['consumer_key'],
+            client_secret=credentials['consumer_secret'],
+            resource_owner_key=credentials['access_token_key'],
+            resource_owner_secret=credentials['access_token_secret'])
+        self._client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+            timeout=httpx.Timeout(30.0))
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self._client.aclose()
+        self.blocker.flush()
+
+    async def _request(self, method, endpoint, params=None):
+        """Signs and sends a request, waits for the rate limit of the endpoint if it is used up"""
+        metrics = self.blocker.metrics
+        # shared with the Blocker, so both know when an endpoint can be used again
+        scheduler = self.blocker.scheduler
+        while True:
+            resume_time = scheduler.resume_time(endpoint)
+            if resume_time is not None:
+                wait = resume_time - time.time() + 1
+                await asyncio.sleep(wait)
+                metrics.increment('rate_limit_sleep_seconds', wait, endpoint=endpoint)
+                continue
+
+            url = f"{self.base_url}/{endpoint}.json"
+            params = {k: v for k, v in (params or {}).items() if v is not None}
+            if method == 'GET':
+                if params:
+                    url = f"{url}?{urlencode(params)}"
+                url, headers, body = self._oauth.sign(url, http_method='GET')
+            else:
+                url, headers, body = self._oauth.sign(
+                    url, http_method=method, body=urlencode(params),
+                    headers={'Content-Type': 'application/x-www-form-urlencoded'})
+            with metrics.timer('api_request_seconds', endpoint=endpoint):
+                response = await self._client.request(method, url, headers=headers, content=body)
+
+            limit = response.headers.get('x-rate-limit-limit')
+            remaining = response.headers.get('x-rate-limit-remaining')
+            reset = response.headers.get('x-rate-limit-reset')
+            if limit is not None and remaining is not None and reset is not None:
+                scheduler.update(endpoint, int(limit), int(remaining), int(reset))
+            if response.status_code == 429:
+                scheduler.exhausted(endpoint, int(reset) if reset is not None else None)
+                continue
+
+            try:
+                data = response.json()
+            except ValueError:
+                raise TwitterError({'message': f"Unexpected response ({response.status_code}): {response.text[:200]}"})
+            if isinstance(data, dict) and 'errors' in data:
+                raise TwitterError(data['errors'])
+            return data
+
+    async def get_follower_ids(self, user_id) -> AsyncGenerator[list[int], None]:
+        next_cursor = -1
+        previous_cursor = None
+        while next_cursor != 0 and next_cursor != previous_cursor:
+            data = await self._request('GET', 'followers/ids', {'user_id': user_id, 'cursor': next_cursor})
+            next_cursor, previous_cursor = data['next_cursor'], data['previous_cursor']
+            self.blocker.metrics.increment('follower_pages_fetched')
+            self.blocker.metrics.increment('follower_ids_fetched', len(data['ids']))
+            yield data['ids']
+
+    async def create_block(self, user_id):
+        """Returns the blocked user as dict or None if it failed"""
+        try:
+            data = await self._request(
+                'POST', 'blocks/create', {'user_id': user_id, 'include_entities': 'false', 'skip_status': 'true'})
+        except TwitterError as e:
+            print(e)
+            return None
+        return {'user_id': data['id'], 'user_name': data['screen_name']}
+
+    async def get_profile_pic(self, twitter_user):
+        url = profile_pic_url(twitter_user)
+        avatar_cache = self.blocker.avatar_cache
+        content = avatar_cache.fresh(url)
+        if content is None:
+            response = await self._client.get(url, headers=avatar_cache.conditional_headers(url))
+            content = avatar_cache.update(url, response.status_code, response.headers, response.content)
+        return Image.open(BytesIO(content))
+
+    async def get_user(self, screen_name=None, user_id=None):
+        """Retrieve a user via Twitter API"""
+        if not (user_id or screen_name):
+            raise ValueError("Either screen_name or user_id must be given")
+        user_cache = self.blocker.user_cache
+        hit, user = user_cache.get(screen_name, user_id)
+        if hit:
+            if isinstance(user, UserSuspendedError):
+                raise user
+            return user
+
+        try:
+            data = await self._request(
+                'GET', 'users/show', {'user_id': user_id} if user_id else {'screen_name': screen_name})
+        except TwitterError as e:
+            if UserSuspendedError.is_this_error(e):
+                error = UserSuspendedError(user_id, screen_name)
+                user_cache.put(error, screen_name, user_id)
+                raise error from e
+            if twitter_error_code(e) == USER_NOT_FOUND_CODE:
+                user_cache.put(None, screen_name, user_id)
+            print(e.message)
+            return None
+
+        user = User.NewFromJsonDict(data)
+        user = UserWrapper(user, await self.get_profile_pic(user))
+        user_cache.put(user)
+        return user
+
+    async def _block_concurrently(self, items) -> AsyncGenerator[bool, None]:
+        """Async counterpart of Blocker._block_concurrently, yields the results in order of the items"""
+        in_flight = deque()
+
+        def finish(item, blocked_user, known):
+            user_id, parents, date = item
+            self.blocker.metrics.count_blocks('skipped' if known else 'succeeded' if blocked_user else 'failed')
+            for parent_id, reason in parents:
+                self.blocker._buffer_block_result(
+                    blocked_user['user_id'] if blocked_user else user_id,
+                    blocked_user['user_name'] if blocked_user else None,
+                    parent_id, reason, date, blocked_user is not None)
+            return blocked_user is not None
+
+        try:
+            for item in items:
+                # followers come filtered by _filter_already_blocked, like in Blocker only targets are looked up
+                blocked_user = None
+                if any(parent_id is None for parent_id, _ in item[1]):
+                    blocked_user = self.blocker.get_blocked_user(item[0])
+                if blocked_user:
+                    in_flight.append((item, None, blocked_user))
+                else:
+                    in_flight.append((item, asyncio.create_task(self.create_block(item[0])), None))
+                while len(in_flight) >= self.concurrency \
+                        or (in_flight and (in_flight[0][1] is None or in_flight[0][1].done())):
+                    item, task, blocked_user = in_flight.popleft()
+                    yield finish(item, await task if task else blocked_user, task is None)
+
+            while in_flight:
+                item, task, blocked_user = in_flight.popleft()
+                yield finish(item, await task if task else blocked_user, task is None)
+        finally:
+            for _, task, _ in in_flight:
+                if task:
+                    task.cancel()
+            self.blocker.flush()
+
+    async def block_users(self, parent_id, user_ids, reason) -> AsyncGenerator[int, None]:
+        """Will block all users in user_ids, yields the number of successful blocks like Blocker.block_users"""
+        date = datetime.utcnow()
+        # users of other targets that are blocked but still sitting in the buffer must be found too
+        self.blocker.flush()
+        successful_blocks, user_ids = self.blocker._filter_already_blocked(parent_id, user_ids, reason, date)
+        # the users are looked up with the synchronous api, like Blocker.block_users does it
+        filtered, user_ids = self.blocker._apply_filter_rules(user_ids)
+        self.blocker._save_to_current_block_run(parent_id, user_ids, reason)
+        metrics = self.blocker.metrics
+        metrics.begin_run()
+        metrics.expect(len(user_ids) + 1 + successful_blocks + filtered)
+        metrics.count_blocks('skipped', successful_blocks + filtered)
+        # the target itself is stored without parent
+        items = chain([(parent_id, [(None, reason)], date)], ((id, [(parent_id, reason)], date) for id in user_ids))
+        try:
+            async for success in self._block_concurrently(items):
+                if success:
+                    successful_blocks += 1
+                yield successful_blocks
+        finally:
+            metrics.end_run()
+
+    async def block_followers(self, user_id, reason) -> AsyncGenerator[int, None]:
+        """Will fetch the followers of user_id and then block them"""
+        follower_ids = array('q')
+        async for page in self.get_follower_ids(user_id):
+            follower_ids.extend(page)
+        async for i in self.block_users(user_id, follower_ids, reason):
+            yield i
+
+
+def iterate(blocker, make_generator, **kwargs):
+    """Drives an AsyncBlocker from synchronous code, e.g. a QThread worker, on its own event loop.
+
+    make_generator gets the ready AsyncBlocker and returns the async generator to run, for example
+    ``iterate(blocker, lambda async_blocker: async_blocker.block_followers(user_id, reason))``. kwargs go to
+    AsyncBlocker.
+    """
+    loop = asyncio.new_event_loop()
+    async_blocker = AsyncBlocker(blocker, **kwargs)
+    loop.run_until_complete(async_blocker.__aenter__())
+    try:
+        agen = make_generator(async_blocker)
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(agen.__anext__())
+                except StopAsyncIteration:
+                    break
+        finally:
+            loop.run_until_complete(agen.aclose())
+    finally:
+        loop.run_until_complete(async_blocker.__aexit__(None, None, None))
+        loop.close()
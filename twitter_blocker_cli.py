@@ -0,0 +1,415 @@
+"""Headless command line interface for twitter_blocker, meant for cron jobs and services.
+
+Progress and results are written to stdout as one JSON object per line, errors go to stderr.
+"""
+from contextlib import redirect_stdout
+from datetime import datetime
+import argparse
+import json
+import sys
+import time
+
+EXIT_OK = 0
+EXIT_ERROR = 1
+# 2 is what argparse exits with on bad arguments
+EXIT_NOT_AUTHENTICATED = 3
+EXIT_TARGET_NOT_FOUND = 4
+EXIT_INTERRUPTED = 130
+
+# the blocker prints its errors, they are sent to stderr so stdout only ever has the JSON lines
+_output = sys.stdout
+
+
+def emit(event, **data):
+    print(json.dumps({'event': event, 'time': round(time.time(), 3), **data}), file=_output, flush=True)
+
+
+def report_progress(blocker, progress, interval):
+    """Emits the progress of a blocking or sync generator at most every interval seconds and returns the last value"""
+    from metrics import ProgressAggregator
+
+    aggregator = ProgressAggregator(blocker.metrics, interval)
+    last = None
+    for last in progress:
+        report = aggregator.update(last)
+        if report is not None:
+            emit_progress(blocker, report)
+    if last is not None:
+        emit_progress(blocker, aggregator.report())
+    return last
+
+
+def resume_times(blocker):
+    # endpoints that are rate limited at the moment and when they can be used again
+    return {endpoint: round(t) for endpoint, t in blocker.scheduler.resume_times().items()}
+
+
+def is_multi_account(blocker):
+    return hasattr(blocker, 'blockers')
+
+
+def emit_progress(blocker, report):
+    if is_multi_account(blocker):
+        # every account has its own rate limits
+        emit('progress', **report, accounts={
+            name: {'count': blocker.progress[name], 'resume_times': resume_times(b)}
+            for name, b in blocker.blockers.items()})
+    else:
+        emit('progress', **report, resume_times=resume_times(blocker))
+
+
+def resolve_target(blocker, target):
+    """Targets are screen names, numeric ones are taken as user ids"""
+    from twitter_blocker import UserSuspendedError
+
+    screen_name = target.lstrip('@')
+    try:
+        if screen_name.isdigit():
+            user = blocker.get_user(user_id=int(screen_name))
+        else:
+            user = blocker.get_user(screen_name=screen_name)
+    except UserSuspendedError as e:
+        emit('target_not_found', target=target, error=e.message)
+        return None
+    if user is None:
+        emit('target_not_found', target=target, error="The user does not exist.")
+    return user
+
+
+def read_targets(path):
+    """One target per line, optionally followed by a reason. Empty lines and lines starting with # are ignored"""
+    targets = []
+    with (sys.stdin if path == '-' else open(path, encoding='utf-8')) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            target, _, reason = line.partition(' ')
+            targets.append((target, reason.strip() or None))
+    return targets
+
+
+def queue_targets(blocker, targets, default_reason):
+    missing = 0
+    for target, reason in targets:
+        user = resolve_target(blocker, target)
+        if user is None:
+            missing += 1
+            continue
+        blocker.queue_target(user.twitter_id, reason if reason is not None else default_reason)
+        emit('queued', target=user.screen_name, user_id=user.twitter_id, follower_count=user.follower_count)
+    return missing
+
+
+def run_queue(blocker, args):
+    count = report_progress(blocker, blocker.block_queue(), args.progress_interval)
+    if is_multi_account(blocker):
+        emit('done', blocked=count or 0, block_counts=blocker.get_block_counts(), run=blocker.metrics.run_status())
+    else:
+        emit('done', blocked=count or 0, block_count=blocker.get_block_count(), run=blocker.metrics.run_status())
+
+
+def block_async(blocker, args):
+    """Blocks the targets one after another with the asyncio engine, resume continues them with the threaded one"""
+    from twitter_blocker_async import iterate
+
+    missing = 0
+    count = 0
+    for target in args.targets:
+        user = resolve_target(blocker, target)
+        if user is None:
+            missing += 1
+            continue
+        emit('queued', target=user.screen_name, user_id=user.twitter_id, follower_count=user.follower_count)
+        progress = iterate(blocker, lambda async_blocker: async_blocker.block_followers(user.twitter_id, args.reason),
+                           concurrency=args.workers)
+        count += report_progress(blocker, progress, args.progress_interval) or 0
+    if missing == len(args.targets):
+        return EXIT_TARGET_NOT_FOUND
+    emit('done', blocked=count, block_count=blocker.get_block_count(), run=blocker.metrics.run_status())
+    return EXIT_TARGET_NOT_FOUND if missing else EXIT_OK
+
+
+def command_block(blocker, args):
+    if args.use_async:
+        return block_async(blocker, args)
+    missing = queue_targets(blocker, [(target, None) for target in args.targets], args.reason)
+    if missing == len(args.targets):
+        return EXIT_TARGET_NOT_FOUND
+    run_queue(blocker, args)
+    return EXIT_TARGET_NOT_FOUND if missing else EXIT_OK
+
+
+def command_file(blocker, args):
+    targets = read_targets(args.path)
+    missing = queue_targets(blocker, targets, args.reason)
+    if targets and missing == len(targets):
+        return EXIT_TARGET_NOT_FOUND
+    run_queue(blocker, args)
+    return EXIT_TARGET_NOT_FOUND if missing else EXIT_OK
+
+
+def command_resume(blocker, args):
+    if is_multi_account(blocker):
+        emit('resume', remaining={name: info[0] for name, info in blocker.get_last_run_info().items()},
+             targets=blocker.primary.get_last_run_target_ids())
+        run_queue(blocker, args)
+        return EXIT_OK
+    remaining, reason = blocker.get_last_run_info()
+    emit('resume', remaining=remaining, targets=blocker.get_last_run_target_ids())
+    run_queue(blocker, args)
+    return EXIT_OK
+
+
+def command_sync(blocker, args):
+    count = report_progress(blocker, blocker.sync_blocklist(full=args.full), args.progress_interval)
+    emit('done', synced=count or 0, synced_block_count=blocker.get_synced_block_count())
+    return EXIT_OK
+
+
+def command_unblock(blocker, args):
+    parent_id = None
+    if args.parent is not None:
+        parent_id = resolve_parent(blocker, args.parent)
+        if parent_id is None:
+            return EXIT_TARGET_NOT_FOUND
+    if parent_id is not None or args.reason is not None or args.since or args.until:
+        blocker.queue_unblock(parent_id, args.reason, args.since, args.until)
+    emit('unblock', queued=blocker.get_unblock_count())
+    count = report_progress(blocker, blocker.continue_unblocking(), args.progress_interval)
+    emit('done', unblocked=count or 0, block_count=blocker.get_block_count())
+    return EXIT_OK
+
+
+def resolve_parent(blocker, parent):
+    """User id of a --parent option, ids are taken as they are since the target might not exist anymore"""
+    if parent.isdigit():
+        return int(parent)
+    user = resolve_target(blocker, parent)
+    return user.twitter_id if user is not None else None
+
+
+def command_export(blocker, args):
+    parent_id = None
+    if args.parent is not None:
+        parent_id = resolve_parent(blocker, args.parent)
+        if parent_id is None:
+            return EXIT_TARGET_NOT_FOUND
+    if args.path == '-':
+        # the blocklist is the output then, there are no JSON lines
+        f = _output.buffer if args.binary else _output
+        blocker.export_blocklist(f, args.binary, parent_id, args.reason)
+        f.flush()
+        return EXIT_OK
+    if args.binary:
+        f = open(args.path, 'wb')
+    else:
+        f = open(args.path, 'w', encoding='utf-8', newline='')
+    with f:
+        count = blocker.export_blocklist(f, args.binary, parent_id, args.reason)
+    emit('exported', path=args.path, count=count)
+    return EXIT_OK
+
+
+def command_import(blocker, args):
+    parent_id = None
+    if args.parent is not None:
+        parent_id = resolve_parent(blocker, args.parent)
+        if parent_id is None:
+            return EXIT_TARGET_NOT_FOUND
+    with (sys.stdin.buffer if args.path == '-' else open(args.path, 'rb')) as f:
+        saved, filtered = blocker.import_blocklist(f, parent_id, args.reason)
+    emit('imported', path=args.path, count=saved, filtered=filtered)
+    if not args.no_block:
+        run_queue(blocker, args)
+    return EXIT_OK
+
+
+def command_preview(blocker, args):
+    from overlap import preview_targets
+
+    users = [user for user in (resolve_target(blocker, target) for target in args.targets) if user is not None]
+    screen_names = {user.twitter_id: user.screen_name for user in users}
+    for preview in preview_targets(blocker, list(screen_names), refresh=args.refresh):
+        emit('preview', target=screen_names[preview['user_id']], **preview)
+    return EXIT_TARGET_NOT_FOUND if len(users) < len(args.targets) else EXIT_OK
+
+
+def command_status(blocker, args):
+    remaining, reason = blocker.get_last_run_info()
+    emit('status',
+         account=blocker.authenticated_user.screen_name,
+         block_count=blocker.get_block_count(),
+         synced_block_count=blocker.get_synced_block_count(),
+         sync_date=blocker.get_sync_date(),
+         remaining=remaining,
+         unblock_remaining=blocker.get_unblock_count(),
+         queued_targets=[{'user_id': t[0], 'reason': t[1], 'fetched': t[2]} for t in blocker.get_queued_targets()])
+    return EXIT_OK
+
+
+def command_account(blocker, args):
+    blocker.save_account_settings(args.consumer_key, args.consumer_secret, args.access_token_key,
+                                  args.access_token_secret)
+    blocker.authenticate()
+    if blocker.authenticated_user is None:
+        print("Not authenticated, check the account settings.", file=sys.stderr)
+        return EXIT_NOT_AUTHENTICATED
+    emit('authenticated', account=blocker.authenticated_user.screen_name)
+    return EXIT_OK
+
+
+def command_accounts(blocker, args):
+    from multi_account import list_accounts
+
+    emit('accounts', accounts=list_accounts())
+    return EXIT_OK
+
+
+def open_blocker(args, metrics):
+    from twitter_blocker import Blocker
+    from filter_rules import FilterRules
+    from multi_account import MultiAccountBlocker, open_account
+
+    filter_rules = FilterRules(
+        allow=args.allow or (), skip_verified=args.skip_verified, skip_following=args.skip_following,
+        min_followers=args.min_followers, max_followers=args.max_followers, skip_keywords=args.skip_bio or ())
+    kwargs = dict(block_workers=args.workers, metrics=metrics, filter_rules=filter_rules)
+    if not args.account:
+        return Blocker(**kwargs)
+    if len(args.account) == 1:
+        return open_account(args.account[0], **kwargs)
+    return MultiAccountBlocker(args.account, **kwargs)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Block Twitter accounts and their followers without the GUI.")
+    parser.add_argument('--progress-interval', type=float, default=1.0, metavar='SECONDS',
+                        help="how often progress is reported (default: %(default)s)")
+    parser.add_argument('--workers', type=int, default=4, help="CreateBlock requests in flight (default: %(default)s)")
+    parser.add_argument('--account', action='append', metavar='NAME',
+                        help="use a registered account instead of the default one, block, file and resume take "
+                             "it several times to apply the same blocks to all of them")
+    rules = parser.add_argument_group("filter rules", "followers that match one of these are not blocked, "
+                                                       "checking them costs one users/lookup request per 100 followers")
+    rules.add_argument('--allow', action='append', metavar='USER', help="screen name or user id, can be repeated")
+    rules.add_argument('--skip-verified', action='store_true', help="don't block verified accounts")
+    rules.add_argument('--skip-following', action='store_true', help="don't block accounts the account follows")
+    rules.add_argument('--min-followers', type=int, metavar='N', help="don't block accounts with less followers")
+    rules.add_argument('--max-followers', type=int, metavar='N', help="don't block accounts with more followers")
+    rules.add_argument('--skip-bio', action='append', metavar='KEYWORD',
+                       help="don't block accounts with KEYWORD in their bio, can be repeated")
+    parser.add_argument('--metrics-json', metavar='PATH', help="append metrics as JSON lines to PATH")
+    parser.add_argument('--metrics-prometheus', metavar='PATH',
+                        help="keep PATH up to date for the node_exporter textfile collector")
+    parser.add_argument('--metrics-interval', type=float, default=10.0, metavar='SECONDS',
+                        help="how often the metrics are written (default: %(default)s)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    block = subparsers.add_parser('block', help="block targets and their followers")
+    block.add_argument('targets', nargs='+', help="screen names or user ids")
+    block.add_argument('--reason', default="", help="stored with every block")
+    block.add_argument('--async', dest='use_async', action='store_true',
+                       help="block with the asyncio engine over a few pooled connections instead of threads, "
+                            "the followers are fetched completely first")
+    block.set_defaults(handler=command_block)
+
+    from_file = subparsers.add_parser('file', help="block the targets listed in a file, - reads stdin")
+    from_file.add_argument('path', help="one target per line, optionally followed by a reason")
+    from_file.add_argument('--reason', default="", help="reason for lines without one")
+    from_file.set_defaults(handler=command_file)
+
+    resume = subparsers.add_parser('resume', help="continue the last block run")
+    resume.set_defaults(handler=command_resume)
+
+    sync = subparsers.add_parser('sync', help="sync the blocklist of the account into the database")
+    sync.add_argument('--full', action='store_true', help="read all blocks instead of only the new ones")
+    sync.set_defaults(handler=command_sync)
+
+    unblock = subparsers.add_parser(
+        'unblock', help="undo blocks made by this program, without conditions the last unblock run is continued")
+    unblock.add_argument('--parent', help="target whose followers are unblocked, screen name or user id")
+    unblock.add_argument('--reason', help="only blocks with that reason")
+    unblock.add_argument('--since', type=datetime.fromisoformat, metavar='DATE',
+                         help="only blocks made at or after DATE, e.g. 2022-03-01 or 2022-03-01T12:00 in UTC")
+    unblock.add_argument('--until', type=datetime.fromisoformat, metavar='DATE', help="only blocks made before DATE")
+    unblock.set_defaults(handler=command_unblock)
+
+    export = subparsers.add_parser('export', help="write the blocks to a CSV or binary file, - is stdout")
+    export.add_argument('path')
+    export.add_argument('--binary', action='store_true', help="sorted user ids only, much smaller than CSV")
+    export.add_argument('--parent', help="only this target and its followers, screen name or user id")
+    export.add_argument('--reason', help="only blocks with that reason")
+    export.set_defaults(handler=command_export)
+
+    import_ = subparsers.add_parser('import', help="block the users of an exported blocklist, - reads stdin")
+    import_.add_argument('path', help="CSV or binary, the format is detected")
+    import_.add_argument('--parent', help="store the users as followers of this target instead of what the file says")
+    import_.add_argument('--reason', help="reason instead of the one in the file")
+    import_.add_argument('--no-block', action='store_true', help="only add the users to the run, resume blocks them")
+    import_.set_defaults(handler=command_import)
+
+    preview = subparsers.add_parser(
+        'preview', help="how many followers of targets are new, shared with earlier targets and how long blocking takes")
+    preview.add_argument('targets', nargs='+', help="screen names or user ids")
+    preview.add_argument('--refresh', action='store_true', help="fetch the followers again even if they are recent")
+    preview.set_defaults(handler=command_preview)
+
+    status = subparsers.add_parser('status', help="show block counts and the state of the queue")
+    status.set_defaults(handler=command_status)
+
+    accounts = subparsers.add_parser('accounts', help="list the registered accounts")
+    accounts.set_defaults(handler=command_accounts)
+
+    account = subparsers.add_parser('account', help="save the twitter API credentials, with --account to register one")
+    for name in ('consumer_key', 'consumer_secret', 'access_token_key', 'access_token_secret'):
+        account.add_argument(name)
+    account.set_defaults(handler=command_account)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.account and len(args.account) > 1 and args.handler not in (command_block, command_file, command_resume):
+        parser.error("only block, file and resume can use several accounts")
+    if args.account and len(args.account) > 1 and getattr(args, 'use_async', False):
+        parser.error("--async blocks with one account only")
+    if args.handler is command_accounts:
+        return command_accounts(None, args)
+    # imported only now so --help and bad arguments return right away
+    from twitter import TwitterError
+    from metrics import JsonLinesSink, Metrics, PrometheusTextfileSink
+
+    metrics = Metrics(interval=args.metrics_interval)
+    if args.metrics_json:
+        metrics.add_sink(JsonLinesSink(args.metrics_json))
+    if args.metrics_prometheus:
+        metrics.add_sink(PrometheusTextfileSink(args.metrics_prometheus))
+
+    try:
+        with redirect_stdout(sys.stderr), open_blocker(args, metrics) as blocker:
+            if is_multi_account(blocker):
+                missing = blocker.unauthenticated_accounts()
+                if missing:
+                    print(f"Not authenticated: {', '.join(missing)}, check the account settings.", file=sys.stderr)
+                    return EXIT_NOT_AUTHENTICATED
+            elif blocker.authenticated_user is None and args.handler is not command_account:
+                print("Not authenticated, check the account settings.", file=sys.stderr)
+                return EXIT_NOT_AUTHENTICATED
+            return args.handler(blocker, args)
+    except KeyboardInterrupt:
+        # everything done so far is saved, resume continues from there
+        emit('interrupted')
+        return EXIT_INTERRUPTED
+    except TwitterError as e:
+        print(e, file=sys.stderr)
+        return EXIT_ERROR
+    except ValueError as e:
+        # e.g. an invalid account name
+        print(e, file=sys.stderr)
+        return EXIT_ERROR
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,8 +1,9 @@
 from PySide6 import QtWidgets
-from PySide6.QtGui import QPixmap, QFont, QRegularExpressionValidator
-from PySide6.QtCore import QTimer, QRegularExpression, QPoint, QObject, QThread, Signal
+from PySide6.QtGui import QImage, QPixmap, QFont, QRegularExpressionValidator
+from PySide6.QtCore import QTimer, QRegularExpression, QPoint, QObject, QThread, QThreadPool, QRunnable, Signal
 from PySide6.QtWidgets import QMessageBox
 from twitter_blocker import Blocker, UserWrapper, UserSuspendedError
+from metrics import ProgressAggregator, format_progress
 from PIL.ImageQt import ImageQt
 from ui_main_window import Ui_MainWindow
 from ui_account_settings_dialog import Ui_settings_dialog
@@ -11,45 +12,142 @@ import sys
 
 class BlockerWorker(QObject):
     finished = Signal()
-    progress = Signal(int)
+    # a report dict of metrics.ProgressAggregator, at most progress_rate times a second
+    progress = Signal(object)
     status_changed = Signal(str)
 
-    def __init__(self, blocker, user_id, reason):
+    def __init__(self, blocker, user_id, reason, progress_rate=15):
         super(BlockerWorker, self).__init__()
         self.blocker = blocker
         self.user_id = user_id
         self.reason = reason
+        self.progress_rate = progress_rate
 
-    def _blocking(self, ids_to_block):
-        self.status_changed.emit("Blocking users")
-        for i in self.blocker.block_users(self.user_id, ids_to_block, self.reason):
-            self.progress.emit(i)
-            self.status_changed.emit(f"Blocked users: {i}")
-        self.finished.emit()
+    def _report_progress(self, counts):
+        # every signal crosses into the event loop, one per user would leave the ui behind on fast runs
+        aggregator = ProgressAggregator(self.blocker.metrics, interval=1 / self.progress_rate)
+        for i in counts:
+            report = aggregator.update(i)
+            if report is not None:
+                self.progress.emit(report)
+        self.progress.emit(aggregator.report())
 
     def continue_(self):
         self.status_changed.emit("Blocking users")
-        for i in self.blocker.continue_blocking():
-            self.progress.emit(i)
-            self.status_changed.emit(f"Blocked users: {i}")
+        with self.blocker.metrics.timer('worker_seconds', task='continue'):
+            self._report_progress(self.blocker.block_queue())
+        self.finished.emit()
+
+    def sync(self):
+        self.status_changed.emit("Syncing blocklist")
+        with self.blocker.metrics.timer('worker_seconds', task='sync'):
+            for i in self.blocker.sync_blocklist():
+                self.status_changed.emit(f"Synced blocks: {i}")
         self.finished.emit()
 
     def run(self):
-        ids_to_block = []
+        # followers are blocked while the remaining pages are still being fetched in the background
         self.status_changed.emit("Retrieving followers")
-        batch = 0
-        for ids in self.blocker.get_follower_ids(self.user_id):
-            batch += 1
-            limit_remaining = self.blocker.api.rate_limit.resources.get('followers').get('/followers/ids').get('remaining')
-            # TODO: Instead of just waiting, the program should start blocking what's there already
-            if limit_remaining == 0:
-                self.status_changed.emit("Retrieving followers (waiting for rate limit to end)")
-            else:
-                self.status_changed.emit("Retrieving followers")
-            print(f"Batch {batch}")
-            ids_to_block.extend(ids)
+        with self.blocker.metrics.timer('worker_seconds', task='block'):
+            self.blocker.queue_target(self.user_id, self.reason)
+            self._report_progress(self.blocker.block_queue())
+        self.finished.emit()
+
+
+class AuthenticationWorker(QObject):
+    authenticated = Signal(object, QImage)
+    failed = Signal()
+
+    def __init__(self, blocker):
+        super(AuthenticationWorker, self).__init__()
+        self.blocker = blocker
+
+    def run(self):
+        self.blocker.authenticate()
+        user = self.blocker.authenticated_user
+        if user is None:
+            self.failed.emit()
+            return
+        try:
+            image = ImageQt(user.profile_pic).copy()
+        except Exception as e:
+            # no picture is no reason to not show the account
+            print(e)
+            image = QImage()
+        self.authenticated.emit(user, image)
+
+
+class UserLookup(QRunnable):
+    def __init__(self, service, lookup_id, screen_name=None, user_id=None):
+        super(UserLookup, self).__init__()
+        self.service = service
+        self.lookup_id = lookup_id
+        self.screen_name = screen_name
+        self.user_id = user_id
 
-        self._blocking(ids_to_block)
+    def run(self):
+        if not self.service.is_current(self.lookup_id):
+            return
+        error = "The user does not exist."
+        try:
+            user = self.service.blocker.get_user(screen_name=self.screen_name, user_id=self.user_id)
+        except UserSuspendedError as e:
+            print(e.message)
+            user = None
+            error = "The user has been suspended."
+        except Exception as e:
+            # e.g. no network, the lookup still has to finish or a resumed run could never be continued
+            print(e)
+            user = None
+            error = "The user could not be looked up."
+
+        if not user:
+            self.service.looked_up.emit(self.lookup_id, None, QImage(), error)
+            return
+        try:
+            # decoding happens here, the GUI thread only has to turn it into a QPixmap
+            # it's weird but without the copy() the program crashes sometimes
+            image = ImageQt(user.profile_pic).copy()
+        except Exception as e:
+            # no picture is no reason to not show the user
+            print(e)
+            image = QImage()
+        self.service.looked_up.emit(self.lookup_id, user, image, "")
+
+
+class UserLookupService(QObject):
+    """Looks up users and their profile pictures in the background, only the latest lookup is delivered"""
+    user_found = Signal(object, QPixmap)
+    lookup_failed = Signal(str)
+    looked_up = Signal(int, object, QImage, str)
+
+    def __init__(self, blocker, parent=None):
+        super(UserLookupService, self).__init__(parent)
+        self.blocker = blocker
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(2)
+        self._current_id = 0
+        self.looked_up.connect(self._deliver)
+
+    def is_current(self, lookup_id):
+        return lookup_id == self._current_id
+
+    def lookup(self, screen_name=None, user_id=None):
+        self.cancel()
+        self._pool.start(UserLookup(self, self._current_id, screen_name, user_id))
+
+    def cancel(self):
+        """Drops lookups that haven't started yet, the results of running ones are ignored"""
+        self._current_id += 1
+        self._pool.clear()
+
+    def _deliver(self, lookup_id, user, image, error):
+        if not self.is_current(lookup_id):
+            return
+        if user is None:
+            self.lookup_failed.emit(error)
+        else:
+            self.user_found.emit(user, QPixmap.fromImage(image))
 
 
 class AccountSettingsDialog(QtWidgets.QDialog, Ui_settings_dialog):
@@ -63,38 +161,53 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         super(MainWindow, self).__init__()
         self.setupUi(self)
         self.current_target_user: UserWrapper = None
+        # id of the target of an unfinished block run until its user data arrived
+        self.resume_target_id = None
 
         self.blocker = blocker
+        self.user_lookup = UserLookupService(self.blocker, self)
         if self.blocker.authenticated_user:
-            self.fill_account_data()
+            # cached from the last session if the blocker defers the authentication
+            self.fill_account_data(self.blocker.authenticated_user.cached_profile_pic())
 
         self.target_user_profile_pic_label.setScaledContents(True)
         self.target_user_screen_name_input.setValidator(QRegularExpressionValidator(QRegularExpression("[a-zA-Z0-9_-]+")))
         self.timer = QTimer()
         self.timer.setSingleShot(True)
+        # shows the metrics of the running worker, e.g. if it's waiting for twitter or the disk
+        self.metrics_timer = QTimer()
+        self.metrics_timer.setInterval(1000)
 
         self.progress_bar.hide()
         self.status_label.hide()
         self.continue_blocking_button.hide()
-        self.continue_last_block_run()
         self._init_events()
+        self.continue_last_block_run()
         self.show()
+        if self.blocker.defer_authentication:
+            self.start_authentication()
 
     def _init_events(self):
         self.timer.timeout.connect(self.set_target_user_data)
+        self.metrics_timer.timeout.connect(self.show_metrics)
         self.target_user_screen_name_input.textEdited.connect(lambda: (
+            self.user_lookup.cancel(),
             self.timer.start(2000),
             self.target_user_screen_name_input.setStyleSheet("")
         ))
+        self.user_lookup.user_found.connect(self.target_user_found)
+        self.user_lookup.lookup_failed.connect(self.target_user_lookup_failed)
         self.block_user_button.clicked.connect(self.start_blocking)
         self.action_account.triggered.connect(self.show_account_settings_dialog)
         self.continue_blocking_button.clicked.connect(self.continue_blocking)
-
-    def fill_account_data(self):
-        image = ImageQt(self.blocker.authenticated_user.profile_pic)
-        # it's weird but without the copy() the program crashes sometimes
-        self.user_profile_pic_label.setPixmap(QPixmap.fromImage(image).copy())
-        self.user_profile_pic_label.setScaledContents(True)
+        self.action_sync_blocklist.triggered.connect(self.start_sync)
+
+    def fill_account_data(self, profile_pic=None):
+        if profile_pic is not None:
+            image = profile_pic if isinstance(profile_pic, QImage) else ImageQt(profile_pic)
+            # it's weird but without the copy() the program crashes sometimes
+            self.user_profile_pic_label.setPixmap(QPixmap.fromImage(image).copy())
+            self.user_profile_pic_label.setScaledContents(True)
         self.user_screen_name_label.setText(f"@{self.blocker.authenticated_user.screen_name}")
         self.user_display_name_label.setText(self.blocker.authenticated_user.display_name)
         self.user_block_count_label.setText(f"{self.blocker.get_block_count()} blocks")
@@ -116,45 +229,86 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
             dialog.access_token_key_edit.text(),
             dialog.access_token_secret_edit.text()
         )
-        self.blocker.authenticate()
-        if self.blocker.authenticated_user:
-            self.fill_account_data()
+        self.start_authentication()
+
+    def start_authentication(self):
+        # verifying the credentials and loading the profile picture can take a while, the window is usable meanwhile
+        self.auth_thread = QThread()
+        self.auth_worker = AuthenticationWorker(self.blocker)
+        self.auth_worker.moveToThread(self.auth_thread)
+        self.auth_thread.started.connect(self.auth_worker.run)
+        self.auth_worker.authenticated.connect(self.account_authenticated)
+        self.auth_worker.failed.connect(self.authentication_failed)
+        self.auth_worker.authenticated.connect(self.auth_thread.quit)
+        self.auth_worker.failed.connect(self.auth_thread.quit)
+        self.auth_thread.finished.connect(self.auth_worker.deleteLater)
+        self.auth_thread.finished.connect(self.auth_thread.deleteLater)
+        # the blocker isn't shared with a blocking or syncing worker before the authentication is done
+        self.enable_authenticated_actions(False)
+        self.auth_thread.start()
+
+    def enable_authenticated_actions(self, enabled=True):
+        self.action_account.setEnabled(enabled)
+        self.action_sync_blocklist.setEnabled(enabled)
+        self.block_user_button.setEnabled(enabled)
+        # an unfinished run can only be continued once its target was looked up
+        self.continue_blocking_button.setEnabled(enabled and self.resume_target_id is None)
+
+    def account_authenticated(self, user, image):
+        self.enable_authenticated_actions()
+        self.fill_account_data(image)
+        if self.resume_target_id is not None:
+            self.user_lookup.lookup(user_id=self.resume_target_id)
+
+    def authentication_failed(self):
+        self.enable_authenticated_actions()
+        self.status_label.setText("Not connected to twitter, check the account settings.")
+        self.status_label.show()
+        if self.resume_target_id is not None:
+            self.target_user_lookup_failed("")
+
+    def clear_target_user_data(self):
+        self.target_user_screen_name_input.setStyleSheet("")
+        self.target_user_profile_pic_label.clear()
+        self.target_user_display_name_label.setText("")
+        self.target_user_stats_label.setText("")
+        self.target_user_description_label.setText("")
+        self.current_target_user = None
+        self.progress_bar.setValue(0)
 
     def set_target_user_data(self):
-        def clear():
-            self.target_user_screen_name_input.setStyleSheet("")
-            self.target_user_profile_pic_label.clear()
-            self.target_user_display_name_label.setText("")
-            self.target_user_stats_label.setText("")
-            self.target_user_description_label.setText("")
-            self.current_target_user = None
-            self.progress_bar.setValue(0)
-
         screen_name = self.target_user_screen_name_input.text()
 
         if not screen_name:
-            clear()
+            self.user_lookup.cancel()
+            self.clear_target_user_data()
         else:
-            error = "The user does not exist."
-            try:
-                user = self.blocker.get_user(screen_name)
-            except UserSuspendedError as e:
-                print(e.message)
-                user = None
-                error = "The user has been suspended."
-
-            if not user:
-                QtWidgets.QToolTip.showText(self.target_user_screen_name_input.mapToGlobal(
-                    QPoint(0, self.target_user_screen_name_input.height()/2)), error)
-                clear()
-                self.target_user_screen_name_input.setStyleSheet("QLineEdit { background: salmon; }")
-                return
-
-            self.current_target_user = user
-            self.fill_target_user_data()
-
-    def fill_target_user_data(self):
-        self.target_user_profile_pic_label.setPixmap(QPixmap.fromImage(ImageQt(self.current_target_user.profile_pic).copy()))
+            self.user_lookup.lookup(screen_name)
+
+    def target_user_found(self, user, pixmap):
+        self.current_target_user = user
+        self.fill_target_user_data(pixmap)
+        if self.resume_target_id is not None:
+            self.resume_target_id = None
+            self.target_user_screen_name_input.setText(user.display_name)
+            self.continue_blocking_button.setEnabled(True)
+
+    def target_user_lookup_failed(self, error):
+        if self.resume_target_id is not None:
+            # the run can be continued without knowing who the target was
+            self.resume_target_id = None
+            self.target_user_screen_name_input.setText("")
+            self.continue_blocking_button.setEnabled(True)
+            return
+        QtWidgets.QToolTip.showText(self.target_user_screen_name_input.mapToGlobal(
+            QPoint(0, self.target_user_screen_name_input.height()/2)), error)
+        self.clear_target_user_data()
+        self.target_user_screen_name_input.setStyleSheet("QLineEdit { background: salmon; }")
+
+    def fill_target_user_data(self, pixmap=None):
+        if pixmap is None:
+            pixmap = QPixmap.fromImage(ImageQt(self.current_target_user.profile_pic).copy())
+        self.target_user_profile_pic_label.setPixmap(pixmap)
         self.target_user_display_name_label.setText(self.current_target_user.display_name)
         self.target_user_stats_label.setText(f"{self.current_target_user.follower_count} Followers")
         self.target_user_description_label.setText(self.current_target_user.description)
@@ -163,14 +317,19 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         self.start_blocking(True)
 
     def start_blocking(self, continue_blocking=False):
-        if not self.current_target_user:
+        if not self.current_target_user and not continue_blocking:
             return
 
-        self.progress_bar.setMaximum(self.current_target_user.follower_count)
+        if self.current_target_user:
+            self.progress_bar.setMaximum(self.current_target_user.follower_count)
+        else:
+            self.progress_bar.setMaximum(0)
         # Step 2: Create a QThread object
         self.thread = QThread()
         # Step 3: Create a worker object
-        self.worker = BlockerWorker(self.blocker, self.current_target_user.twitter_id, self.block_reason_input.text())
+        self.worker = BlockerWorker(
+            self.blocker, self.current_target_user.twitter_id if self.current_target_user else None,
+            self.block_reason_input.text())
         # Step 4: Move worker to the thread
         self.worker.moveToThread(self.thread)
         # Step 5: Connect signals and slots
@@ -181,7 +340,7 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         self.worker.finished.connect(self.thread.quit)
         self.worker.finished.connect(self.worker.deleteLater)
         self.thread.finished.connect(self.thread.deleteLater)
-        self.worker.progress.connect(lambda x: self.progress_bar.setValue(x))
+        self.worker.progress.connect(self.show_progress)
         self.worker.status_changed.connect(lambda x: self.status_label.setText(x))
         # Final resets
         self.thread.finished.connect(
@@ -195,8 +354,42 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         self.thread.start()
         self.enable_ui(False)
 
+    def start_sync(self):
+        # blocks that already exist on twitter don't need a CreateBlock call when blocking later
+        self.progress_bar.setMaximum(0)
+        self.thread = QThread()
+        self.worker = BlockerWorker(self.blocker, None, None)
+        self.worker.moveToThread(self.thread)
+        self.thread.started.connect(self.worker.sync)
+        self.worker.finished.connect(self.thread.quit)
+        self.worker.finished.connect(self.worker.deleteLater)
+        self.thread.finished.connect(self.thread.deleteLater)
+        self.worker.status_changed.connect(lambda x: self.status_label.setText(x))
+        self.thread.finished.connect(
+            lambda: (
+                self.enable_ui(True),
+                QMessageBox.about(self, "Done", f"Synced {self.blocker.get_synced_block_count()} blocks")
+            )
+        )
+        self.thread.start()
+        self.enable_ui(False)
+
+    def show_progress(self, report):
+        self.progress_bar.setValue(report['count'])
+        self.status_label.setText(format_progress(report))
+
+    def show_metrics(self):
+        waiting = self.blocker.scheduler.summary()
+        summary = self.blocker.metrics.summary()
+        self.statusBar().showMessage(f"{summary} · {waiting}" if waiting and summary else waiting or summary)
 
     def enable_ui(self, enabled=True):
+        # the status bar follows the worker while the rest of the ui is disabled, afterwards it keeps the last numbers
+        if enabled:
+            self.metrics_timer.stop()
+        else:
+            self.metrics_timer.start()
+        self.show_metrics()
         self.target_user_screen_name_input.setEnabled(enabled)
         self.block_reason_input.setEnabled(enabled)
         self.block_user_button.setEnabled(enabled)
@@ -217,23 +410,30 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
     def continue_last_block_run(self):
         remaining_blocks, reason = self.blocker.get_last_run_info()
         if remaining_blocks is not None and remaining_blocks > 0:
-            user_id = self.blocker.get_last_run_target_id()
-            self.current_target_user = self.blocker.get_user(user_id=user_id)
-            self.target_user_screen_name_input.setText(self.current_target_user.display_name)
             self.target_user_screen_name_input.setEnabled(False)
             self.block_reason_input.setText(reason)
             self.block_reason_input.setEnabled(False)
-            self.fill_target_user_data()
             self.block_user_button.hide()
             self.continue_blocking_button.show()
-
-
-with Blocker() as b:
-    app = QtWidgets.QApplication(sys.argv)
-    # TODO make emojis show correctly again
-    # Used to add the font to enable emojis in twitter profiles an names but it messes up
-    # everything in Qt6/PySide6
-    #app.font()
-    #QFont.insertSubstitution(app.font().family(), "Noto Color Emoji")
-    window = MainWindow(b)
-    app.exec()
+            user_id = self.blocker.get_last_run_target_id()
+            if user_id is None:
+                return
+            # the target is shown once its data arrived, continuing has to wait until then
+            self.resume_target_id = user_id
+            self.target_user_screen_name_input.setText("Loading…")
+            self.continue_blocking_button.setEnabled(False)
+            if not self.blocker.defer_authentication:
+                self.user_lookup.lookup(user_id=user_id)
+
+
+if __name__ == '__main__':
+    # the window shows the account from the last session right away, twitter is asked in the background
+    with Blocker(defer_authentication=True) as b:
+        app = QtWidgets.QApplication(sys.argv)
+        # TODO make emojis show correctly again
+        # Used to add the font to enable emojis in twitter profiles an names but it messes up
+        # everything in Qt6/PySide6
+        #app.font()
+        #QFont.insertSubstitution(app.font().family(), "Noto Color Emoji")
+        window = MainWindow(b)
+        app.exec()
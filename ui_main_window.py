@@ -37,6 +37,8 @@ class Ui_MainWindow(object):
         self.actionAccount.setObjectName(u"actionAccount")
         self.action_account = QAction(MainWindow)
         self.action_account.setObjectName(u"action_account")
+        self.action_sync_blocklist = QAction(MainWindow)
+        self.action_sync_blocklist.setObjectName(u"action_sync_blocklist")
         self.centralwidget = QWidget(MainWindow)
         self.centralwidget.setObjectName(u"centralwidget")
         self.verticalLayout_2 = QVBoxLayout(self.centralwidget)
@@ -234,6 +236,7 @@ class Ui_MainWindow(object):
 
         self.menubar.addAction(self.menusettings.menuAction())
         self.menusettings.addAction(self.action_account)
+        self.menusettings.addAction(self.action_sync_blocklist)
 
         self.retranslateUi(MainWindow)
 
@@ -244,6 +247,7 @@ class Ui_MainWindow(object):
         MainWindow.setWindowTitle(QCoreApplication.translate("MainWindow", u"Twitter Mass Blocker", None))
         self.actionAccount.setText(QCoreApplication.translate("MainWindow", u"Account", None))
         self.action_account.setText(QCoreApplication.translate("MainWindow", u"Account", None))
+        self.action_sync_blocklist.setText(QCoreApplication.translate("MainWindow", u"Sync blocklist", None))
         self.groupBox_2.setTitle(QCoreApplication.translate("MainWindow", u"Your account", None))
         self.user_profile_pic_label.setText("")
         self.user_screen_name_label.setText(QCoreApplication.translate("MainWindow", u"Screen Name", None))